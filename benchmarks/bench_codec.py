@@ -0,0 +1,58 @@
+import json
+import os
+import random
+import time
+
+from bench_common import emit
+import codec
+
+BENCH_RECORDS = int(os.getenv("BENCH_RECORDS", 100000))
+BENCH_TAGS = int(os.getenv("BENCH_TAGS", 5000))  # Distinct MACs among the records
+BENCH_SEED = int(os.getenv("BENCH_SEED", 1))
+
+#-------------------------------------------------------
+# Beacon records as the listener produces them
+#-------------------------------------------------------
+def make_records(rng):
+    now = int(time.time())
+    macs = [":".join(f"{rng.randrange(256):02X}" for _ in range(6)) for _ in range(BENCH_TAGS)]
+    records = []
+    for i in range(BENCH_RECORDS):
+        records.append({
+            "gateway_id": f"gw{rng.randrange(40)}",
+            "tag_id": rng.choice(macs),
+            "rssi": rng.randint(-100, -30),
+            "timestamp": now + i // 1000,
+            "flag_timeout": 1,
+            "ingest_ts": now + i / 1000
+        })
+    return records
+
+def measure(encode, decode, records):
+    started = time.perf_counter()
+    encoded = [encode(record) for record in records]
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_time = time.perf_counter() - started
+
+    size = sum(len(data) for data in encoded)
+    return {
+        "bytes_per_record": round(size / len(records), 1),
+        "encode_per_sec": round(len(records) / encode_time),
+        "decode_per_sec": round(len(records) / decode_time)
+    }
+
+
+if __name__ == "__main__":
+    records = make_records(random.Random(BENCH_SEED))
+
+    # What the listener writes with each setting, and what the processor pays to read it back
+    results = {
+        "stdlib_json": measure(lambda record: json.dumps(record).encode(), json.loads, records),
+        "fast_json": measure(codec.dumps, codec.loads, records),
+        "binary": measure(codec.encode_binary, codec.decode_beacon, records)
+    }
+    emit("codec", {"records": BENCH_RECORDS, "tags": BENCH_TAGS, "orjson": codec.orjson is not None}, results)
@@ -0,0 +1,40 @@
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT")  # Also append each result as a JSON line to this file
+
+# Latency percentiles (ms) of a list of durations in seconds
+def latency_summary(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def at(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 3)
+    return {"count": len(ordered), "p50_ms": at(0.5), "p90_ms": at(0.9), "p99_ms": at(0.99), "max_ms": at(1.0)}
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# Print one machine-readable result line (and append it to BENCH_OUTPUT)
+def emit(benchmark, params, results):
+    line = json.dumps({
+        "benchmark": benchmark,
+        "time": int(time.time()),
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+        "max_rss_mb": max_rss_mb()
+    })
+    print(line)
+    if BENCH_OUTPUT:
+        with open(BENCH_OUTPUT, "a") as output:
+            output.write(line + "\n")
@@ -0,0 +1,66 @@
+import os
+import time
+import tracemalloc
+from collections import deque
+
+from bench_common import emit
+import processor
+
+NUM_GATEWAYS = int(os.getenv("BENCH_GATEWAYS", 40))
+NUM_TAGS = int(os.getenv("BENCH_TAGS", 250))
+
+#-------------------------------------------------------
+# Previous representation: plain object with a deque of tuples
+#-------------------------------------------------------
+class DequeTag:
+    def __init__(self, tag_id, rssi, timestamp, flag_timeout):
+        self.tag_id = tag_id
+        self.rssi = rssi
+        self.timestamp = timestamp
+        self.flag_timeout = flag_timeout
+        self.history = deque(maxlen=processor.HISTORY_SIZE)
+
+    def update_data(self, rssi, timestamp, flag_timeout):
+        self.rssi = rssi
+        self.timestamp = timestamp
+        self.flag_timeout = flag_timeout
+        self.history.append((rssi, timestamp))
+
+#-------------------------------------------------------
+# Measure bytes per tracked (gateway, tag) pair
+#-------------------------------------------------------
+def measure(tag_class, readings):
+    base_time = int(time.time())
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    store = {}
+    for g in range(NUM_GATEWAYS):
+        tags = {}
+        for t in range(NUM_TAGS):
+            tag_id = f"AA:BB:CC:{g % 256:02X}:{t // 256:02X}:{t % 256:02X}"
+            tag = tag_class(tag_id, -60, base_time, 1)
+            for i in range(readings):
+                # Fresh int objects per timestamp, as produced by json.loads
+                tag.update_data(-40 - (i % 50), int(str(base_time + i)), 1)
+            tags[tag_id] = tag
+        store[f"gw{g}"] = tags
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / (NUM_GATEWAYS * NUM_TAGS)
+
+
+if __name__ == "__main__":
+    results = {}
+    for readings in (1, 10, processor.HISTORY_SIZE):
+        legacy = measure(DequeTag, readings)
+        compact = measure(processor.Tag, readings)
+        results[f"readings_{readings}"] = {
+            "deque_bytes_per_pair": round(legacy),
+            "ring_bytes_per_pair": round(compact),
+            "ratio": round(legacy / compact, 1)
+        }
+    emit("memory", {"gateways": NUM_GATEWAYS, "tags": NUM_TAGS, "pairs": NUM_GATEWAYS * NUM_TAGS}, results)
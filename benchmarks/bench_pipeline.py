@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+
+import fakeredis
+import redis
+
+from bench_common import emit
+import loadgen
+
+BENCH_DURATION = float(os.getenv("BENCH_DURATION", 10))  # Seconds of generated load
+BENCH_DRAIN = float(os.getenv("BENCH_DRAIN", 3))  # Seconds left for the pipeline to catch up afterwards
+BENCH_AWS_MS = float(os.getenv("BENCH_AWS_MS", 20))  # Simulated AWS IoT publish round-trip
+
+#-------------------------------------------------------
+# Local stand-ins: one fakeredis server for every stage, no broker, a sleeping AWS client
+#-------------------------------------------------------
+server = fakeredis.FakeServer()
+redis.Redis = lambda *args, **kwargs: fakeredis.FakeRedis(server=server)
+
+class StubIotClient:
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, qos, payload):
+        time.sleep(BENCH_AWS_MS / 1000)
+        self.published += 1
+
+import metrics
+import listener
+import processor
+import publisher
+
+listener.redis_client = fakeredis.FakeAsyncRedis(server=server)
+processor.async_redis_client = fakeredis.FakeAsyncRedis(server=server)
+publisher.aws_client = StubIotClient()
+
+# Run the processor stages until `stop` is set
+def run_processor(stop):
+    async def stages():
+        tasks = [asyncio.create_task(stage) for stage in
+                 (processor.consume_list(), processor.process_queue(), processor.soft_timer())]
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    asyncio.run(stages())
+
+# Feed scan reports to the listener's ingest queue at LOADGEN_SCAN_HZ per gateway, as its MQTT receiver would
+async def generate_load(scene, rng):
+    tasks = listener.start_ingest_tasks()
+    period = 1 / loadgen.LOADGEN_SCAN_HZ
+    started = time.time()
+    next_send = started
+    while time.time() - started < BENCH_DURATION:
+        for gateway_id, tags in scene.items():
+            listener.enqueue_message(f"bluetooth/{gateway_id}/data", loadgen.make_payload(tags, rng).encode(), time.time())
+            next_send += period / len(scene)
+            await asyncio.sleep(max(next_send - time.time(), 0))
+    elapsed = time.time() - started
+
+    await asyncio.sleep(BENCH_DRAIN)
+    for task in tasks:
+        task.cancel()
+    return elapsed
+
+
+if __name__ == "__main__":
+    rng = random.Random(loadgen.LOADGEN_SEED)
+    scene = loadgen.build_scene(rng)
+    params = {"gateways": loadgen.LOADGEN_GATEWAYS, "tags": loadgen.LOADGEN_TAGS,
+              "coverage": loadgen.LOADGEN_COVERAGE, "scan_hz": loadgen.LOADGEN_SCAN_HZ, "repeats": loadgen.LOADGEN_REPEATS,
+              "rssi": loadgen.LOADGEN_RSSI, "duration": BENCH_DURATION, "aws_ms": BENCH_AWS_MS,
+              "engine": processor.SCORING_ENGINE, "ingest_batch_ms": listener.INGEST_BATCH_MS,
+              "ingest_dedup_ms": listener.INGEST_DEDUP_MS,
+              "publish_batch_size": publisher.PUBLISH_BATCH_SIZE}
+
+    # Every stage logs per beacon or per event; keep that out of the result line,
+    # and stop the stages before it is written
+    stop = threading.Event()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        stages = [threading.Thread(target=run_processor, args=(stop,)),
+                  threading.Thread(target=publisher.main, args=(stop,))]
+        for stage in stages:
+            stage.start()
+
+        elapsed = asyncio.run(generate_load(scene, rng))
+
+        stop.set()
+        for stage in stages:
+            stage.join()
+
+    # Each stage flushed its counters and histograms to the shared fakeredis server
+    pipe = fakeredis.FakeRedis(server=server).pipeline(transaction=False)
+    metrics.read_commands(pipe)
+    summary = metrics.summarize({}, metrics.snapshot_from(pipe.execute()), elapsed)
+
+    results = {}
+    for stage, stage_summary in summary.items():
+        results[stage] = {
+            "rates": stage_summary["rates"],
+            "histograms": {name: values for name, values in stage_summary["histograms"].items() if values["count"]}
+        }
+    results["aws_publish_calls"] = publisher.aws_client.published
+    emit("pipeline", params, results)
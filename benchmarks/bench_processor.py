@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import time
+
+import fakeredis
+
+from bench_common import emit, latency_summary
+import processor
+
+BENCH_GATEWAYS = int(os.getenv("BENCH_GATEWAYS", 10))
+BENCH_TAGS = int(os.getenv("BENCH_TAGS", 2000))
+BENCH_READINGS = int(os.getenv("BENCH_READINGS", 10))  # Readings per (gateway, tag) before measuring
+BENCH_BATCH = int(os.getenv("BENCH_BATCH", 1000))  # Beacons per process_tag tick
+BENCH_ROUNDS = int(os.getenv("BENCH_ROUNDS", 50))
+BENCH_SEED = int(os.getenv("BENCH_SEED", 1))
+BENCH_TICK_READINGS = int(os.getenv("BENCH_TICK_READINGS", 100000))  # Readings per scoring tick: one second at 100k/s
+BENCH_TICK_ROUNDS = int(os.getenv("BENCH_TICK_ROUNDS", 5))
+
+#-------------------------------------------------------
+# Populate the processor with every tag heard by every gateway
+#-------------------------------------------------------
+def populate(base_time, rng):
+    for g in range(BENCH_GATEWAYS):
+        for t in range(BENCH_TAGS):
+            for i in range(BENCH_READINGS):
+                processor.ingest_beacon(json.dumps({
+                    "gateway_id": f"gw{g}", "tag_id": f"tag{t}", "rssi": rng.randint(-90, -40),
+                    "timestamp": base_time - BENCH_READINGS + i + 1, "flag_timeout": 1
+                }))
+    while not processor.queue.empty():
+        processor.queue.get_nowait()
+
+def bench_get_filtered_data(rng):
+    processor.reset_state()
+    now = int(time.time())
+    populate(now, rng)
+    tags = [tag for gateway in processor.gateways.values() for tag in gateway.tags.values()]
+
+    samples = []
+    for _ in range(BENCH_ROUNDS):
+        started = time.perf_counter()
+        for tag in tags:
+            tag.get_filtered_data(now)
+        samples.append(time.perf_counter() - started)
+
+    total = sum(samples)
+    return {"tags": len(tags), "calls_per_sec": round(len(tags) * BENCH_ROUNDS / total), "pass": latency_summary(samples)}
+
+# One tick's worth of readings applied to the in-memory state, then the touched tags scored with
+# SCORING_ENGINE; no JSON or Redis, so this is the ceiling the scoring path allows per core
+def bench_scoring(rng):
+    processor.reset_state()
+    now = int(time.time())
+    populate(now, rng)
+    gateways = list(processor.gateways.values())
+    pairs = sum(len(gateway.tags) for gateway in gateways)
+
+    samples = []
+    score_samples = []
+    for _ in range(BENCH_TICK_ROUNDS):
+        now += 1
+        readings = [(rng.choice(gateways), f"tag{rng.randrange(BENCH_TAGS)}", rng.randint(-90, -40))
+                    for _ in range(BENCH_TICK_READINGS)]
+
+        started = time.perf_counter()
+        for gateway, tag_id, rssi in readings:
+            gateway.add_beacon(tag_id, rssi, now, 1)
+        scoring = time.perf_counter()
+        dirty_tags = {tag_id for _, tag_id, _ in readings}
+        dirty_tags.update(tag_id for _, tag_id in processor.expire_windows(now))
+        processor.score_tags(dirty_tags, now)
+        finished = time.perf_counter()
+
+        samples.append(finished - started)
+        score_samples.append(finished - scoring)
+
+    total = sum(samples)
+    return {"pairs": pairs, "tick_readings": BENCH_TICK_READINGS,
+            "readings_per_sec": round(BENCH_TICK_READINGS * BENCH_TICK_ROUNDS / total),
+            "tick": latency_summary(samples), "score": latency_summary(score_samples)}
+
+async def bench_process_tag(rng):
+    processor.reset_state()
+    processor.async_redis_client = fakeredis.FakeAsyncRedis()
+    now = int(time.time())
+
+    samples = []
+    for _ in range(BENCH_ROUNDS):
+        beacons = [{
+            "gateway_id": f"gw{rng.randrange(BENCH_GATEWAYS)}", "tag_id": f"tag{rng.randrange(BENCH_TAGS)}",
+            "rssi": rng.randint(-90, -40), "timestamp": now, "flag_timeout": 1
+        } for _ in range(BENCH_BATCH)]
+
+        started = time.perf_counter()
+        for beacon in beacons:
+            processor.ingest_beacon(json.dumps(beacon))
+        batch = [processor.queue.get_nowait() for _ in range(processor.queue.qsize())]
+        await processor.process_tag(batch)
+        samples.append(time.perf_counter() - started)
+
+    total = sum(samples)
+    return {"batch": BENCH_BATCH, "beacons_per_sec": round(BENCH_BATCH * BENCH_ROUNDS / total), "tick": latency_summary(samples)}
+
+# Time soft_timer from the first deadline until every tag has been expired and written
+async def bench_soft_timer(rng):
+    processor.reset_state()
+    processor.async_redis_client = fakeredis.FakeAsyncRedis()
+    stale_time = int(time.time()) - processor.TAG_TIMEOUT - 1
+    populate(stale_time, rng)
+    await processor.process_tag([])
+    pairs = sum(len(gateway.tags) for gateway in processor.gateways.values())
+
+    started = time.perf_counter()
+    task = asyncio.create_task(processor.soft_timer())
+    while any(gateway.tags for gateway in processor.gateways.values()):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+
+    return {"pairs": pairs, "expired_per_sec": round(pairs / elapsed), "seconds": round(elapsed, 3)}
+
+
+if __name__ == "__main__":
+    rng = random.Random(BENCH_SEED)
+    params = {"gateways": BENCH_GATEWAYS, "tags": BENCH_TAGS, "readings": BENCH_READINGS,
+              "batch": BENCH_BATCH, "rounds": BENCH_ROUNDS, "tick_readings": BENCH_TICK_READINGS,
+              "tick_rounds": BENCH_TICK_ROUNDS, "engine": processor.SCORING_ENGINE}
+
+    # The processor logs every placement change; keep that out of the measurements' output
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {
+            "get_filtered_data": bench_get_filtered_data(rng),
+            "scoring": bench_scoring(rng),
+            "process_tag": asyncio.run(bench_process_tag(rng)),
+            "soft_timer": asyncio.run(bench_soft_timer(rng))
+        }
+    emit("processor", params, results)
@@ -0,0 +1,48 @@
+import os
+import time
+
+from bench_common import emit
+import processor
+
+NUM_GATEWAYS = int(os.getenv("BENCH_GATEWAYS", 40))
+NUM_TAGS = int(os.getenv("BENCH_TAGS", 2500))  # 40 x 2500 = 100k (gateway, tag) pairs
+READINGS = int(os.getenv("BENCH_READINGS", 20))  # History length per pair
+
+#-------------------------------------------------------
+# Build a populated state, snapshot it and load it back
+#-------------------------------------------------------
+def build_state(base_time):
+    state = {}
+    for g in range(NUM_GATEWAYS):
+        tags = []
+        for t in range(NUM_TAGS):
+            tag = processor.Tag(f"AA:BB:CC:DD:{t // 256:02X}:{t % 256:02X}", -60, base_time, 1)
+            for i in range(READINGS):
+                tag.update_data(-40 - (i + g + t) % 50, base_time - READINGS + i, 1)
+            tags.append(tag)
+        state[f"gw{g}"] = tags
+    return state
+
+
+if __name__ == "__main__":
+    base_time = int(time.time())
+    state = build_state(base_time)
+    pairs = NUM_GATEWAYS * NUM_TAGS
+
+    started = time.perf_counter()
+    blobs = {gateway_id: processor.encode_gateway_snapshot(gateway_id, tags) for gateway_id, tags in state.items()}
+    encode_time = time.perf_counter() - started
+    size = sum(len(blob) for blob in blobs.values())
+
+    started = time.perf_counter()
+    for blob in blobs.values():
+        gateway_id, tags = processor.decode_gateway_snapshot(blob)
+        processor.restore_gateway(gateway_id, tags, base_time)
+    load_time = time.perf_counter() - started
+
+    emit("snapshot", {"gateways": NUM_GATEWAYS, "tags": NUM_TAGS, "pairs": pairs, "readings": READINGS}, {
+        "snapshot_mb": round(size / 1e6, 2),
+        "bytes_per_pair": round(size / pairs),
+        "encode_seconds": round(encode_time, 3),
+        "load_seconds": round(load_time, 3)
+    })
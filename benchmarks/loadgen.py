@@ -0,0 +1,72 @@
+import json
+import math
+import os
+import random
+import time
+
+import paho.mqtt.client as mqtt
+
+BROKER_HOST = os.getenv("BROKER_HOST", "localhost")
+BROKER_PORT = int(os.getenv("BROKER_PORT", 1883))
+
+LOADGEN_GATEWAYS = int(os.getenv("LOADGEN_GATEWAYS", 10))
+LOADGEN_TAGS = int(os.getenv("LOADGEN_TAGS", 1000))
+LOADGEN_COVERAGE = int(os.getenv("LOADGEN_COVERAGE", 3))  # Gateways hearing each tag
+LOADGEN_SCAN_HZ = float(os.getenv("LOADGEN_SCAN_HZ", 1))  # Scan reports per gateway per second
+LOADGEN_REPEATS = int(os.getenv("LOADGEN_REPEATS", 1))  # Times each tag appears in one scan report (dense scans)
+LOADGEN_RSSI = os.getenv("LOADGEN_RSSI", "normal")  # "normal" (path loss + noise) or "uniform"
+LOADGEN_RSSI_STD = float(os.getenv("LOADGEN_RSSI_STD", 4))  # dB of noise around the path-loss RSSI
+LOADGEN_DURATION = float(os.getenv("LOADGEN_DURATION", 60))  # Seconds to publish for
+LOADGEN_SEED = int(os.getenv("LOADGEN_SEED", 1))
+
+#-------------------------------------------------------
+# Synthetic scene: tags placed on a line of gateways, each heard by its nearest LOADGEN_COVERAGE gateways
+#-------------------------------------------------------
+def build_scene(rng):
+    scene = {f"gw{g}": [] for g in range(LOADGEN_GATEWAYS)}
+    for t in range(LOADGEN_TAGS):
+        mac = f"AA:BB:{t >> 24 & 0xFF:02X}:{t >> 16 & 0xFF:02X}:{t >> 8 & 0xFF:02X}:{t & 0xFF:02X}"
+        position = rng.uniform(0, LOADGEN_GATEWAYS - 1)
+        nearest = sorted(range(LOADGEN_GATEWAYS), key=lambda g: abs(g - position))[:LOADGEN_COVERAGE]
+        for g in nearest:
+            # Log-distance path loss: -55 dBm at 1 m, exponent 2.5, 5 m between gateways
+            distance = max(abs(g - position) * 5, 1)
+            scene[f"gw{g}"].append((mac, -55 - 25 * math.log10(distance)))
+    return scene
+
+def sample_rssi(mean_rssi, rng):
+    if LOADGEN_RSSI == "uniform":
+        return rng.randint(-100, -40)
+    return max(min(round(rng.gauss(mean_rssi, LOADGEN_RSSI_STD)), -30), -110)
+
+# One scan report in the gateway's `dev_list` format
+def make_payload(tags, rng):
+    return json.dumps({"dev_list": [{"mac": mac, "rssi": sample_rssi(mean_rssi, rng)}
+                                    for mac, mean_rssi in tags for _ in range(LOADGEN_REPEATS)]})
+
+
+if __name__ == "__main__":
+    rng = random.Random(LOADGEN_SEED)
+    scene = build_scene(rng)
+
+    client = mqtt.Client()
+    client.connect(BROKER_HOST, BROKER_PORT, 60)
+    client.loop_start()
+
+    # Every gateway reports once per scan period, spread evenly over the period
+    period = 1 / LOADGEN_SCAN_HZ
+    started = time.time()
+    next_send = started
+    sent = beacons = 0
+    while time.time() - started < LOADGEN_DURATION:
+        for gateway_id, tags in scene.items():
+            client.publish(f"bluetooth/{gateway_id}/data", make_payload(tags, rng))
+            sent += 1
+            beacons += len(tags) * LOADGEN_REPEATS
+            next_send += period / len(scene)
+            time.sleep(max(next_send - time.time(), 0))
+
+    elapsed = time.time() - started
+    client.loop_stop()
+    print(json.dumps({"messages": sent, "beacons": beacons, "seconds": round(elapsed, 3),
+                      "messages_per_sec": round(sent / elapsed, 1), "beacons_per_sec": round(beacons / elapsed, 1)}))
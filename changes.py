@@ -0,0 +1,39 @@
+import os
+import time
+import codec
+
+# Compact change notifications from the pipeline stages, relayed to browsers by the UI.
+# They only say what changed; the UI reads the current state back (beacon_changes,
+# gateway_last_seen, queue depths), so a missed notification is caught up by the next one
+CHANGES_CHANNEL = "pipeline_changes"
+
+# The config page writes `config:<KEY>` and publishes here; processors reload without a restart
+CONFIG_CHANNEL = "config_changes"
+
+# Seconds of `beacon_changes` kept for delta reads (written by the processor, read by the UI)
+BEACON_CHANGES_RETENTION = int(os.getenv("BEACON_CHANGES_RETENTION", 3600))
+
+# Version every `beacon_changes` write atomically in Redis: the current time in ms, but always above the
+# newest version, so versions increase in commit order across processors and the UI and a reader that
+# already passed version v never misses a later write
+BEACON_CHANGES_SCRIPT = """
+local version = math.max(tonumber(ARGV[1]), tonumber(redis.call('GET', KEYS[2]) or 0) + 1)
+redis.call('SET', KEYS[2], version)
+for i = 3, #ARGV do
+    redis.call('ZADD', KEYS[1], version, ARGV[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', version - tonumber(ARGV[2]))
+return version
+"""
+
+def record_beacon_changes(pipe, tag_ids):
+    pipe.eval(BEACON_CHANGES_SCRIPT, 2, "beacon_changes", "beacon_changes:version",
+              int(time.time() * 1000), BEACON_CHANGES_RETENTION * 1000, *tag_ids)
+
+# Seconds without MQTT messages before a gateway is offline (swept by the listener, shown by the UI)
+GATEWAY_OFFLINE_THRESHOLD = int(os.getenv("GATEWAY_OFFLINE_THRESHOLD", 30))
+
+# Change types: "beacons" (placements changed, tags detected or lost), "gateways"
+# (online/offline transitions) and "queues" (beacon or AWS queue depth changed)
+def publish_change(pipe, change_type, **fields):
+    pipe.publish(CHANGES_CHANNEL, codec.dumps(dict(fields, type=change_type)))
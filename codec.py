@@ -0,0 +1,123 @@
+import json
+import os
+import struct
+import sys
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Falls back to the standard library
+
+# Beacon records in beacon_data/beacon_stream: "json" or "binary". Readers accept both, so
+# the listener can switch while JSON records written before the switch are still queued
+RECORD_CODEC = os.getenv("RECORD_CODEC", "json")
+
+#-------------------------------------------------------
+# Fast JSON: orjson when installed (returns bytes), compact stdlib json otherwise
+#-------------------------------------------------------
+if orjson is not None:
+    dumps = orjson.dumps
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+#-------------------------------------------------------
+# Binary beacon record (little endian):
+#   magic (u8 0x01), flags (u8), rssi (i8), timestamp (u32), flag_timeout (u8), ingest_ts (f64),
+#   gateway_id (u8 length + utf-8),
+#   tag_id: 6 raw bytes when it is a MAC address (flag 0x01), else u8 length + utf-8,
+#   count (u16) and rssi_max (i8) for listener aggregates (flag 0x02)
+# JSON records start with "{", so the first byte tells the formats apart
+#-------------------------------------------------------
+BINARY_MAGIC = 0x01
+FLAG_MAC = 0x01
+FLAG_AGGREGATE = 0x02
+RECORD_HEADER = struct.Struct("<BBbIBd")
+RECORD_AGGREGATE = struct.Struct("<Hb")
+
+# Decoded gateway and tag IDs are interned: one string object per ID in the processor
+intern = sys.intern
+
+def pack_mac(mac):
+    if len(mac) != 17:
+        return None
+    try:
+        return bytes.fromhex(mac.replace(":", ""))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=65536)
+def unpack_mac(raw):
+    return intern(raw.hex(":").upper())
+
+def encode_binary(record):
+    tag_id = record["tag_id"]
+    mac = pack_mac(tag_id)
+    # Only MACs in canonical upper-case form round-trip through 6 bytes
+    if mac is not None and unpack_mac(mac) != tag_id:
+        mac = None
+    flags = (FLAG_MAC if mac is not None else 0) | (FLAG_AGGREGATE if "count" in record else 0)
+
+    gateway_bytes = record["gateway_id"].encode()
+    parts = [
+        RECORD_HEADER.pack(BINARY_MAGIC, flags, record["rssi"], record["timestamp"],
+                           record.get("flag_timeout", 1), record.get("ingest_ts") or 0.0),
+        bytes((len(gateway_bytes),)), gateway_bytes
+    ]
+    if mac is not None:
+        parts.append(mac)
+    else:
+        tag_bytes = tag_id.encode()
+        parts += [bytes((len(tag_bytes),)), tag_bytes]
+    if flags & FLAG_AGGREGATE:
+        parts.append(RECORD_AGGREGATE.pack(record["count"], record.get("rssi_max", record["rssi"])))
+    return b"".join(parts)
+
+def decode_binary(data):
+    _, flags, rssi, timestamp, flag_timeout, ingest_ts = RECORD_HEADER.unpack_from(data, 0)
+    offset = RECORD_HEADER.size
+
+    length = data[offset]
+    gateway_id = intern(data[offset + 1:offset + 1 + length].decode())
+    offset += 1 + length
+
+    if flags & FLAG_MAC:
+        tag_id = unpack_mac(data[offset:offset + 6])
+        offset += 6
+    else:
+        length = data[offset]
+        tag_id = intern(data[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+
+    record = {
+        "gateway_id": gateway_id,
+        "tag_id": tag_id,
+        "rssi": rssi,
+        "timestamp": timestamp,
+        "flag_timeout": flag_timeout
+    }
+    if ingest_ts:
+        record["ingest_ts"] = ingest_ts
+    if flags & FLAG_AGGREGATE:
+        record["count"], record["rssi_max"] = RECORD_AGGREGATE.unpack_from(data, offset)
+    return record
+
+# Encode a beacon record with RECORD_CODEC; records binary cannot hold (e.g. a non-numeric rssi) stay JSON
+def encode_beacon(record):
+    if RECORD_CODEC == "binary":
+        try:
+            return encode_binary(record)
+        except (struct.error, TypeError, KeyError, ValueError):
+            pass
+    return dumps(record)
+
+# Decode a beacon record in either format
+def decode_beacon(data):
+    if data[:1] == b"\x01":
+        return decode_binary(data)
+    return loads(data)
@@ -1,9 +1,17 @@
-import paho.mqtt.client as mqtt
+import asyncio
 import json
 import time
 import os
+import socket
+from collections import defaultdict
+import aiomqtt
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
+import metrics
+import codec
+import changes
+import partitions
 
 load_dotenv()
 
@@ -13,59 +21,327 @@ BROKER_PORT = int(os.getenv("BROKER_PORT", 1883))
 QUEUE_HOST = os.getenv("QUEUE_HOST", "localhost")
 QUEUE_PORT = int(os.getenv("QUEUE_PORT", 6379))
 
-redis_client = redis.Redis(host=QUEUE_HOST, port=QUEUE_PORT, db=0)
+# Broker subscriptions (comma separated) and session: a fixed client id without clean session
+# lets the broker keep the subscriptions across reconnects. It only queues messages for the
+# listener while it is disconnected at QoS 1 or 2 (and only those the gateways publish at QoS >= 1);
+# QoS 0 messages sent during a drop are lost
+LISTENER_TOPICS = [topic.strip() for topic in os.getenv("LISTENER_TOPICS", "bluetooth/+/data").split(",") if topic.strip()]
+LISTENER_QOS = int(os.getenv("LISTENER_QOS", 1))
+LISTENER_CLIENT_ID = os.getenv("LISTENER_CLIENT_ID", f"listener-{socket.gethostname()}")
+LISTENER_RECONNECT_DELAY = int(os.getenv("LISTENER_RECONNECT_DELAY", 5))  # Seconds between broker reconnects
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print(f"Connected to {BROKER_HOST}:{BROKER_PORT}")
-        client.subscribe("bluetooth/+/data")
-    else:   
-        print(f"Connection failed with code {rc}")
+# Receipt and Redis writes are decoupled by a bounded queue of raw MQTT messages.
+# Receipt never waits: when the writers fall behind (slow Redis) the queue drops
+# the "oldest" or the "newest" message, so keepalives and PUBACKs are never delayed
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))  # Messages buffered between receipt and writers
+INGEST_DROP_POLICY = os.getenv("INGEST_DROP_POLICY", "oldest")  # "oldest" or "newest"
+INGEST_WRITERS = int(os.getenv("INGEST_WRITERS", 2))  # Concurrent Redis writer tasks
+INGEST_RETRY_MAX = float(os.getenv("INGEST_RETRY_MAX", 2))  # Max seconds between retries of a failed write
 
-def on_message(client, userdata, msg):
-    try:
+# Ingest batching: beacons are buffered and written in one pipelined round-trip
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))  # Flush when this many beacons are buffered
+INGEST_BATCH_MS = int(os.getenv("INGEST_BATCH_MS", 50))  # Max age of a micro-batch (0 = flush every message)
+INGEST_DEDUP_MS = int(os.getenv("INGEST_DEDUP_MS", 0))  # Collapse readings per (gateway, tag) over this window (0 = off)
+INGEST_STATS_INTERVAL = int(os.getenv("INGEST_STATS_INTERVAL", 10))  # Seconds between beacons/sec reports
+
+# Transport to the processor: "list" (beacon_data) or "stream" (beacon_stream, consumer groups)
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", 1000000))  # Approximate cap on stream length
+
+# Gateway liveness from MQTT traffic: `gateway_last_seen` (sorted set, score = last message time)
+# plus `gateways_online` (set); the expiry sweep moves gateways in and out and reports transitions
+GATEWAY_SEEN_INTERVAL = int(os.getenv("GATEWAY_SEEN_INTERVAL", 5))  # Min seconds between last-seen writes per gateway (keep well below the threshold)
+
+redis_client = aioredis.Redis(host=QUEUE_HOST, port=QUEUE_PORT, db=0)
+
+#-------------------------------------------------------
+# Ingest state, owned by the event loop
+#-------------------------------------------------------
+ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)  # (topic, payload, receipt time)
+
+# Pre-aggregation window: {(gateway_id, tag_id): [count, rssi_sum, rssi_max, last timestamp, first ingest_ts]}
+aggregates = {}
 
-        topic = msg.topic
-        payload = json.loads(msg.payload.decode())
+ingested = 0  # Beacons written to Redis since the last stats report
+dropped = 0  # Messages dropped by the queue policy since the last stats report
+
+gateway_seen = {}  # {gateway_id: receipt time last queued for gateway_last_seen}
+seen_pending = {}  # {gateway_id: receipt time} written by the next liveness sweep
+
+stage_metrics = metrics.StageMetrics("listener")
+
+# Queue of the partition owning a tag
+def partition_key(tag_id):
+    base = "beacon_stream" if QUEUE_TRANSPORT == "stream" else "beacon_data"
+    return partitions.partition_key(base, partitions.partition_of(tag_id))
+
+# Note a message from a gateway; at most one last-seen write per GATEWAY_SEEN_INTERVAL
+def note_gateway(topic, received):
+    parts = topic.split("/")
+    if len(parts) < 2:
+        return
+    gateway_id = parts[1]
+    if received - gateway_seen.get(gateway_id, 0) >= GATEWAY_SEEN_INTERVAL:
+        gateway_seen[gateway_id] = received
+        seen_pending[gateway_id] = received
+
+# Hand a received message to the writers without ever waiting
+def enqueue_message(topic, payload, received):
+    global dropped
+    note_gateway(topic, received)  # Liveness counts every message, even one the queue drops
+    if ingest_queue.full():
+        dropped += 1
+        stage_metrics.count("dropped")
+        if INGEST_DROP_POLICY == "newest":
+            return
+        ingest_queue.get_nowait()
+    ingest_queue.put_nowait((topic, payload, received))
+
+# Turn one scan report into beacon records (or fold it into the aggregation window)
+def parse_message(topic, payload, received):
+    try:
+        payload = codec.loads(payload)
 
         #Extract Gateway ID from Topic
         gateway_id = topic.split("/")[1]
-        print(f"Extracted Gateway ID: {gateway_id}")  # Debugging gateway_id
-        
+
         # Extract beacon data
         dev_list = payload.get("dev_list", [])
+        timestamp = int(received)  # Receipt time, so a backlog in ingest_queue does not shift readings
+        stage_metrics.count("messages")
+        stage_metrics.count("beacons", len(dev_list))
 
-        for i, device in enumerate(dev_list, start=1):
-            tag_id = device.get("mac", "N/A")  # MAC address is the tag_id
-            rssi = device.get("rssi", "N/A")
-            timestamp = int(time.time())
-
-            print(f"Beacon {i}: Tag_ID: {tag_id}, RSSI: {rssi}, Timestamp: {timestamp}")
+        # Pre-aggregation: fold the readings into the current window, closed by aggregate_flusher
+        if INGEST_DEDUP_MS > 0:
+            for device in dev_list:
+                rssi = device.get("rssi")
+                if not isinstance(rssi, (int, float)):
+                    continue
+                key = (gateway_id, device.get("mac", "N/A"))
+                entry = aggregates.get(key)
+                if entry is None:
+                    aggregates[key] = [1, rssi, rssi, timestamp, received]
+                else:
+                    entry[0] += 1
+                    entry[1] += rssi
+                    entry[2] = max(entry[2], rssi)
+                    entry[3] = timestamp
+            return []
 
-            # Store in Redis
-            redis_client.rpush("beacon_data", json.dumps({
+        records = []
+        for device in dev_list:
+            tag_id = device.get("mac", "N/A")  # MAC address is the tag_id
+            records.append((partition_key(tag_id), codec.encode_beacon({
                 "gateway_id": gateway_id,
                 "tag_id": tag_id,
-                "rssi": rssi,
+                "rssi": device.get("rssi", "N/A"),
                 "timestamp": timestamp,
-                "flag_timeout": 1
-            }))
-
-            print(f"Pushed {len(dev_list)} beacon(s) from {gateway_id} to Redis")
+                "flag_timeout": 1,
+                "ingest_ts": received
+            })))
+        return records
 
     except json.JSONDecodeError:
-        print(f"Received non-JSON message on '{topic}': {msg.payload.decode()}")
+        print(f"Received non-JSON message on '{topic}': {payload}")
     except Exception as e:
         print(f"Error processing message: {e}")
+    return []
+
+#-------------------------------------------------------
+# Redis writers
+#-------------------------------------------------------
+
+# Write records in one pipeline; a failed write is retried with backoff while the queue absorbs (or drops) new messages
+async def write_records(records, started):
+    global ingested
+    stage_metrics.observe("batch_size", len(records))
+    stage_metrics.observe("batch_age_ms", (time.time() - started) * 1000)
+
+    delay = 0.1
+    while True:
+        flush_started = time.time()
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            if QUEUE_TRANSPORT == "stream":
+                for key, record in records:
+                    pipe.xadd(key, {"data": record}, maxlen=STREAM_MAXLEN, approximate=True)
+            else:
+                by_key = defaultdict(list)
+                for key, record in records:
+                    by_key[key].append(record)
+                for key, key_records in by_key.items():
+                    for start in range(0, len(key_records), INGEST_BATCH_SIZE):
+                        pipe.rpush(key, *key_records[start:start + INGEST_BATCH_SIZE])
+            await pipe.execute()
+            break
+        except redis.RedisError as e:
+            stage_metrics.count("flush_errors")
+            print(f"Error pushing {len(records)} beacon(s) to Redis, retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INGEST_RETRY_MAX)
+
+    stage_metrics.observe("flush_ms", (time.time() - flush_started) * 1000)
+    stage_metrics.count("queued", len(records))
+    ingested += len(records)
+
+# Collect up to INGEST_BATCH_SIZE records or INGEST_BATCH_MS worth of messages, then write them
+async def writer():
+    loop = asyncio.get_running_loop()
+    while True:
+        topic, payload, received = await ingest_queue.get()
+        records = parse_message(topic, payload, received)
+        deadline = loop.time() + INGEST_BATCH_MS / 1000
+
+        while len(records) < INGEST_BATCH_SIZE:
+            if not ingest_queue.empty():
+                records += parse_message(*ingest_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                records += parse_message(*await asyncio.wait_for(ingest_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        if records:
+            await write_records(records, received)
+
+# Close the aggregation window: one record per (gateway, tag) with its reading count and mean/max RSSI
+async def aggregate_flusher():
+    global aggregates
+    while True:
+        await asyncio.sleep(INGEST_DEDUP_MS / 1000)
+        if not aggregates:
+            continue
+        window, aggregates = aggregates, {}
+
+        records = []
+        started = time.time()
+        for (gateway_id, tag_id), (count, rssi_sum, rssi_max, timestamp, ingest_ts) in window.items():
+            started = min(started, ingest_ts)
+            records.append((partition_key(tag_id), codec.encode_beacon({
+                "gateway_id": gateway_id,
+                "tag_id": tag_id,
+                "rssi": round(rssi_sum / count),
+                "rssi_max": rssi_max,
+                "count": count,
+                "timestamp": timestamp,
+                "flag_timeout": 1,
+                "ingest_ts": ingest_ts
+            })))
+        stage_metrics.count("aggregated", len(records))
+
+        for start in range(0, len(records), INGEST_BATCH_SIZE):
+            await write_records(records[start:start + INGEST_BATCH_SIZE], started)
+
+# Write the pending last-seen times, then sweep the gateways whose last message crossed
+# changes.GATEWAY_OFFLINE_THRESHOLD since the previous sweep. Set membership makes each transition
+# reported once, even with several listeners
+def gateway_status_entries(gateway_ids, status, current_time):
+    entry = codec.dumps({"status": status, "ip": "Unknown", "last_seen": current_time})
+    return {gateway_id: entry for gateway_id in gateway_ids}
+
+async def gateway_liveness():
+    global seen_pending
+    swept_until = "-inf"  # The first sweep also catches gateways that went offline while stopped
+    while True:
+        await asyncio.sleep(1)
+        current_time = time.time()
+        cutoff = current_time - changes.GATEWAY_OFFLINE_THRESHOLD
+        seen, seen_pending = seen_pending, {}
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            if seen:
+                pipe.zadd("gateway_last_seen", seen, gt=True)
+                for gateway_id in seen:
+                    pipe.sadd("gateways_online", gateway_id)
+            pipe.zrangebyscore("gateway_last_seen", swept_until, cutoff)
+            replies = await pipe.execute()
+
+            online = [gateway_id for gateway_id, added in zip(seen, replies[1:-1]) if added]
+            expired = [gateway_id.decode() for gateway_id in replies[-1]]
+
+            pipe = redis_client.pipeline(transaction=False)
+            for gateway_id in expired:
+                pipe.srem("gateways_online", gateway_id)
+            offline = [gateway_id for gateway_id, removed in zip(expired, await pipe.execute()) if removed]
+        except redis.RedisError as e:
+            print(f"Error updating gateway liveness: {e}")
+            for gateway_id, received in seen.items():
+                seen_pending.setdefault(gateway_id, received)  # Written by the next sweep
+            continue
+        swept_until = f"({cutoff}"
+
+        if not (online or offline):
+            continue
+        for gateway_id in online:
+            print(f"Gateway {gateway_id} online")
+        for gateway_id in offline:
+            print(f"Gateway {gateway_id} offline")
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            if online:
+                pipe.hset("gateway_status", mapping=gateway_status_entries(online, "Online", current_time))
+            if offline:
+                pipe.hset("gateway_status", mapping=gateway_status_entries(offline, "Offline", current_time))
+            changes.publish_change(pipe, "gateways", online=online, offline=offline)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error reporting gateway transitions: {e}")
+
+# Flush the stage metrics and report throughput
+async def stats_reporter():
+    global ingested, dropped
+    last_report = time.time()
+    while True:
+        await asyncio.sleep(metrics.METRICS_INTERVAL)
+        now = time.time()
+
+        stage_metrics.observe("queue_depth", ingest_queue.qsize())
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            stage_metrics.flush(pipe)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error writing listener metrics: {e}")
+
+        if now - last_report >= INGEST_STATS_INTERVAL:
+            print(f"Ingest rate: {ingested / (now - last_report):.1f} beacons/sec, "
+                  f"queue {ingest_queue.qsize()}/{INGEST_QUEUE_SIZE}, dropped {dropped} message(s)")
+            ingested = dropped = 0
+            last_report = now
+
+# Everything downstream of MQTT receipt
+def start_ingest_tasks():
+    tasks = [asyncio.create_task(writer()) for _ in range(INGEST_WRITERS)]
+    tasks.append(asyncio.create_task(stats_reporter()))
+    tasks.append(asyncio.create_task(gateway_liveness()))
+    if INGEST_DEDUP_MS > 0:
+        tasks.append(asyncio.create_task(aggregate_flusher()))
+    return tasks
+
+#-------------------------------------------------------
+# MQTT receipt
+#-------------------------------------------------------
+async def main():
+    tasks = start_ingest_tasks()  # Keep references so the tasks are not garbage collected
+
+    while True:
+        try:
+            async with aiomqtt.Client(BROKER_HOST, BROKER_PORT, identifier=LISTENER_CLIENT_ID,
+                                      clean_session=False, keepalive=60) as client:
+                print(f"Connected to {BROKER_HOST}:{BROKER_PORT}")
+                for topic in LISTENER_TOPICS:
+                    await client.subscribe(topic, qos=LISTENER_QOS)
+
+                async for message in client.messages:
+                    enqueue_message(message.topic.value, message.payload, time.time())
+        except aiomqtt.MqttError as e:
+            print(f"Connection to {BROKER_HOST}:{BROKER_PORT} lost ({e}), reconnecting in {LISTENER_RECONNECT_DELAY}s. Ensure NanoMQ is running.")
+            await asyncio.sleep(LISTENER_RECONNECT_DELAY)
 
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
-
-try:
-    client.connect(BROKER_HOST, BROKER_PORT, 60)
-    client.loop_forever()
-except ConnectionRefusedError:
-    print(f"Failed to connect to {BROKER_HOST}:{BROKER_PORT}. Ensure NanoMQ is running.")
-except Exception as e:
-    print(f"Error: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+# Pipeline stages reporting metrics. Each stage owns two Redis hashes:
+#   metrics:<stage>       counters (HINCRBY) plus `updated_at`
+#   metrics:<stage>:hist  histogram buckets, field "<name>:<bucket>"
+STAGES = ("listener", "processor", "publisher")
+METRICS_INTERVAL = 1  # Seconds between flushes of the in-process aggregates
+
+# HDR-style log-linear buckets: SUB_BUCKETS per power of two (~9% relative error on percentiles)
+SUB_BUCKETS = 8
+MIN_VALUE = 0.001
+
+def bucket_of(value):
+    return math.floor(math.log2(max(value, MIN_VALUE)) * SUB_BUCKETS)
+
+def bucket_upper(bucket):
+    return 2 ** ((bucket + 1) / SUB_BUCKETS)
+
+# Value below which a fraction `q` of the observations fall, from {bucket: count}
+def percentile(buckets, q):
+    total = sum(buckets.values())
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= rank:
+            return round(bucket_upper(bucket), 3)
+    return round(bucket_upper(max(buckets)), 3)
+
+#-------------------------------------------------------
+# In-process aggregation, flushed to Redis by the stage's own loop
+#-------------------------------------------------------
+class StageMetrics:
+    def __init__(self, stage):
+        self.stage = stage
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        bucket = bucket_of(value)
+        with self.lock:
+            self.histograms[name][bucket] += 1
+
+    def due(self, now):
+        return now - self.last_flush >= METRICS_INTERVAL
+
+    # Queue the aggregates on `pipe` (sync or asyncio) and reset them; the caller executes it
+    def flush(self, pipe):
+        with self.lock:
+            counters, self.counters = self.counters, defaultdict(int)
+            histograms, self.histograms = self.histograms, defaultdict(lambda: defaultdict(int))
+        self.last_flush = time.time()
+
+        for name, n in counters.items():
+            pipe.hincrby(f"metrics:{self.stage}", name, n)
+        for name, buckets in histograms.items():
+            for bucket, n in buckets.items():
+                pipe.hincrby(f"metrics:{self.stage}:hist", f"{name}:{bucket}", n)
+        pipe.hset(f"metrics:{self.stage}", "updated_at", self.last_flush)
+
+#-------------------------------------------------------
+# Reading side: snapshots of the cumulative hashes, summarized over a time window
+#-------------------------------------------------------
+def read_commands(pipe):
+    for stage in STAGES:
+        pipe.hgetall(f"metrics:{stage}")
+        pipe.hgetall(f"metrics:{stage}:hist")
+
+def snapshot_from(replies):
+    snapshot = {}
+    for stage, counters, histograms in zip(STAGES, replies[0::2], replies[1::2]):
+        counters = {key.decode(): float(value) for key, value in counters.items()}
+        buckets = defaultdict(dict)
+        for field, n in histograms.items():
+            name, bucket = field.decode().rsplit(":", 1)
+            buckets[name][int(bucket)] = int(n)
+        snapshot[stage] = {
+            "updated_at": counters.pop("updated_at", 0.0),
+            "counters": counters,
+            "histograms": dict(buckets)
+        }
+    return snapshot
+
+# Rates and percentiles of what happened between two snapshots taken `seconds` apart
+def summarize(old, new, seconds):
+    summary = {}
+    for stage, current in new.items():
+        previous = old.get(stage, {"counters": {}, "histograms": {}})
+        rates = {name: round((value - previous["counters"].get(name, 0)) / seconds, 1)
+                 for name, value in current["counters"].items()} if seconds > 0 else {}
+
+        histograms = {}
+        for name, buckets in current["histograms"].items():
+            before = previous["histograms"].get(name, {})
+            delta = {bucket: n - before.get(bucket, 0) for bucket, n in buckets.items() if n > before.get(bucket, 0)}
+            histograms[name] = {
+                "count": sum(delta.values()),
+                "p50": percentile(delta, 0.5),
+                "p90": percentile(delta, 0.9),
+                "p99": percentile(delta, 0.99),
+                "max": percentile(delta, 1.0)
+            }
+
+        summary[stage] = {"updated_at": current["updated_at"], "rates": rates, "histograms": histograms}
+    return summary
@@ -0,0 +1,22 @@
+import os
+import zlib
+
+# Sharded processing: the listener splits beacons over PROCESSOR_PARTITIONS queues by a hash
+# of tag_id, the processor workers share the partitions (1 = a single unsuffixed queue)
+PROCESSOR_PARTITIONS = int(os.getenv("PROCESSOR_PARTITIONS", 1))
+
+# Partition owning a tag
+def partition_of(tag_id):
+    if PROCESSOR_PARTITIONS <= 1:
+        return 0
+    return zlib.crc32(tag_id.encode()) % PROCESSOR_PARTITIONS
+
+# Queue (list or stream) of one partition
+def partition_key(base, partition):
+    if PROCESSOR_PARTITIONS <= 1:
+        return base
+    return f"{base}:{partition}"
+
+# Queues of every partition
+def partition_keys(base):
+    return [partition_key(base, partition) for partition in range(PROCESSOR_PARTITIONS)]
@@ -1,11 +1,30 @@
 import json
 import time
 import os
-from collections import defaultdict, deque
+import heapq
+import itertools
+import socket
+import struct
+import sys
+import multiprocessing
+import signal
+import operator
+from array import array
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 import threading
+import metrics
+import codec
+import changes
+import partitions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # The vectorized scoring engine is optional
 
 import asyncio
 
@@ -17,8 +36,27 @@ W1 = 0.8  # Weight for RSSI in score calculation
 W2 = 0.2  # Weight for frequency in score calculation
 FREQ_THRESHOLD = 1
 RSSI_THRESHOLD = -80
+HISTORY_SIZE = 100  # Readings kept per (gateway, tag) pair
+TAG_TIMEOUT = int(os.getenv("TAG_TIMEOUT", 30))  # Seconds without readings before a gateway drops a tag
+EVENT_LOG_RETENTION = int(os.getenv("EVENT_LOG_RETENTION", 86400))  # Seconds of detected/lost history kept in beacon_event_log
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", 5))  # Seconds between incremental state snapshots (0 = off)
+
+SCORING_ENGINE = os.getenv("SCORING_ENGINE", "python")  # "python" or "numpy" (vectorized)
+
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", 1000))  # Max beacons drained per LPOP
+CONSUMER_BLOCK_TIMEOUT = int(os.getenv("CONSUMER_BLOCK_TIMEOUT", 1))  # Seconds BLPOP waits on an empty queue
 
-redis_client = redis.Redis(host="127.0.0.1", port=6379, db=0)
+# Transport from the listener and to the publisher: "list" (beacon_data/aws_queue) or "stream"
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", 1000000))  # Approximate cap on aws_stream length
+STREAM_CLAIM_IDLE_MS = int(os.getenv("STREAM_CLAIM_IDLE_MS", 60000))  # Reclaim entries pending longer than this
+STREAM_GROUP = "processor"
+STREAM_CONSUMER = os.getenv("STREAM_CONSUMER", f"{socket.gethostname()}-{os.getpid()}")
+
+# Sharding: the listener partitions beacons by tag_id (partitions.py), MAX_WORKERS processes split the partitions
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 1))
+
+async_redis_client = aioredis.Redis(host="127.0.0.1", port=6379, db=0)
 
 
 #-------------------------------------------------------
@@ -29,211 +67,1177 @@ gateways = {}
 
 queue = asyncio.Queue()
 
+# Partitions consumed by this process; a worker owns every partition p with p % MAX_WORKERS == worker_id
+owned_partitions = list(range(partitions.PROCESSOR_PARTITIONS))
+
+# Tag-centric index: {tag_id: {gateway_id: Tag}} for every gateway currently hearing the tag
+tag_index = {}
+
+stage_metrics = metrics.StageMetrics("processor")
+
+# Tags that lost a gateway outside of process_tag and must be rescored on the next tick
+rescore_tags = set()
+
+# Tags removed from memory whose Redis removal failed: {tag_id: (gateway_id, removal time)}, retried by soft_timer
+pending_removals = {}
+
+# Write-through caches of what is stored in Redis, so ticks never read it back
+last_events = {}  # {tag_id: "detected" | "lost"}, mirrors `beacon_last_event`
+written_state = {}  # {tag_id: [(gateway_id, score), ...]} last written to `beacon_state`
+
+# Pending window expiries: (deadline, seq, gateway_id, Tag); one entry per tag with a non-empty window
+window_heap = []
+window_seq = itertools.count()
+
+# (partition, gateway_id) whose tags changed since the last snapshot
+snapshot_dirty = set()
+
+# Pending tag timeouts: (deadline, seq, gateway_id, Tag); one entry per tracked tag, rescheduled lazily
+expiry_heap = []
+
+# Forget every tag, cache and pending write (tests and benchmarks start each run from here)
+def reset_state():
+    global pair_store
+    pair_store = new_pair_store()
+    gateways.clear()
+    tag_index.clear()
+    rescore_tags.clear()
+    pending_removals.clear()
+    last_events.clear()
+    written_state.clear()
+    window_heap.clear()
+    expiry_heap.clear()
+    snapshot_dirty.clear()
+    while not queue.empty():
+        queue.get_nowait()
+
 #-------------------------------------------------------
 # Class definitions
 #-------------------------------------------------------
 
 class Gateway:
+    __slots__ = ("gateway_id", "tags")
+
     def __init__(self, gateway_id):
         self.gateway_id = gateway_id
-        self.num_tags = 0
         self.tags = {}  # Dictionary to store tags {tag_id: Beacon object}
 
     # Add or update a beacon in the gateway
-    def add_beacon(self, tag_id, rssi, timestamp, flag_timeout):
+    def add_beacon(self, tag_id, rssi, timestamp, flag_timeout, count=1):
         if tag_id in self.tags:
             # Update existing tag's data
-            self.tags[tag_id].update_data(rssi, timestamp, flag_timeout)
+            tag = self.tags[tag_id]
+            tag.update_data(rssi, timestamp, flag_timeout, count)
+
+            # Make sure the window of this tag gets aged out later
+            if not tag.window_scheduled:
+                schedule_window_expiry(self.gateway_id, tag)
         else:
-            # Create new tag and store it
-            self.tags[tag_id] = Tag(tag_id, rssi, timestamp, flag_timeout)
+            # Create new tag and store it; its first record counts too (all `count` readings of an aggregate)
+            tag = Tag(tag_id, rssi, timestamp, flag_timeout)
+            tag.update_data(rssi, timestamp, flag_timeout, count)
+            self.tags[tag_id] = tag
+            tag_index.setdefault(tag_id, {})[self.gateway_id] = tag
+            if pair_store is not None:
+                pair_store.add(self.gateway_id, tag)
+            heapq.heappush(expiry_heap, (timestamp + TAG_TIMEOUT, next(window_seq), self.gateway_id, tag))
+            schedule_window_expiry(self.gateway_id, tag)
 
-    # Check and remove tags based on flag_timeout
-    def remove_expired_tags(self):
-        expired_tags = [tag_id for tag_id, tag in self.tags.items() if tag.flag_timeout == 0]
+        snapshot_dirty.add((partitions.partition_of(tag_id), self.gateway_id))
 
-        # Remove expired tags
-        for tag_id in expired_tags:
-            print(f"Removing expired Tag: {tag_id} from Gateway {self.gateway_id}")
-            del self.tags[tag_id]
+    # Remove a tag from this gateway, return True if no other gateway still hears it
+    def remove_tag(self, tag_id):
+        tag = self.tags.pop(tag_id)
+        if tag.pair_slot >= 0:
+            pair_store.remove(tag)
+        snapshot_dirty.add((partitions.partition_of(tag_id), self.gateway_id))
 
-        # Set remaining tags' flag_timeout to 0 for the next check
-        for tag in self.tags.values():
-            tag.flag_timeout = 0
+        seen_by = tag_index.get(tag_id)
+        if seen_by is None:
+            return True
+        seen_by.pop(self.gateway_id, None)
+        if seen_by:
+            return False
+        del tag_index[tag_id]
+        return True
 
     # Return the number of tags detected
     def get_beacon_count(self):
         return len(self.tags)
 
 class Tag:
+    __slots__ = (
+        "tag_id", "rssi", "timestamp", "flag_timeout",
+        "history_rssi", "history_ts", "history_count", "history_start",
+        "window_sum", "window_count", "window_readings", "window_scheduled", "pair_slot"
+    )
+
     def __init__(self, tag_id, rssi, timestamp, flag_timeout):
         self.tag_id = tag_id
         self.rssi = rssi
         self.timestamp = timestamp
         self.flag_timeout = flag_timeout
-        self.history = deque(maxlen=100)
+
+        # Ring buffer of the last HISTORY_SIZE entries, grown on demand; an entry aggregated
+        # by the listener stands for `history_count` readings with `history_rssi` as their mean
+        self.history_rssi = array("b")
+        self.history_ts = array("I")
+        self.history_count = array("H")
+        self.history_start = 0  # Index of the oldest entry once the buffer is full
+
+        # Running stats over the newest `window_count` entries of history:
+        # window_sum is the RSSI sum and window_readings the number of readings they stand for
+        self.window_sum = 0
+        self.window_count = 0
+        self.window_readings = 0
+        self.window_scheduled = False
+        self.pair_slot = -1  # Slot in pair_store, -1 when the tag is not stored there
+
+    # Readings in arrival order, oldest first
+    @property
+    def history(self):
+        n = len(self.history_rssi)
+        return [(self.history_rssi[(self.history_start + i) % n], self.history_ts[(self.history_start + i) % n])
+                for i in range(n)]
+
+    # Index in the ring buffer of the i-th oldest reading
+    def _slot(self, i):
+        return (self.history_start + i) % len(self.history_rssi)
 
     # Update the tag data
-    def update_data(self, rssi, timestamp, flag_timeout):
+    def update_data(self, rssi, timestamp, flag_timeout, count=1):
+        # History holds whole dBm in a signed byte: round fractional readings, clamp outliers
+        if type(rssi) is not int or not -128 <= rssi <= 127:
+            rssi = min(max(int(round(rssi)), -128), 127)
+
+        window_sum = self.window_sum + rssi * count
+        window_count = self.window_count + 1
+        window_readings = self.window_readings + count
+        n = len(self.history_rssi)
+
+        if n < HISTORY_SIZE:
+            self.history_rssi.append(rssi)
+            self.history_ts.append(timestamp)
+            self.history_count.append(count)
+        else:
+            # The oldest entry is overwritten; drop it from the window too
+            oldest = self.history_start
+            if self.window_count == n:
+                window_sum -= self.history_rssi[oldest] * self.history_count[oldest]
+                window_count -= 1
+                window_readings -= self.history_count[oldest]
+            self.history_rssi[oldest] = rssi
+            self.history_ts[oldest] = timestamp
+            self.history_count[oldest] = count
+            self.history_start = (oldest + 1) % n
+
         self.rssi = rssi
         self.timestamp = timestamp
         self.flag_timeout = flag_timeout
-        self.history.append((rssi, timestamp))
+        self.window_sum = window_sum
+        self.window_count = window_count
+        self.window_readings = window_readings
+        if self.pair_slot >= 0:
+            pair_store.changed.add(self)
         
     # Get data from the last WINDOW_SIZE seconds"
     def get_filtered_data(self, current_time):
         return [(r, t) for r, t in self.history if current_time - t <= WINDOW_SIZE]
 
+    # Drop readings older than WINDOW_SIZE from the front of the window, return True if any expired
+    def expire_window(self, current_time):
+        expired = False
+        n = len(self.history_rssi)
+        while self.window_count:
+            slot = (self.history_start + n - self.window_count) % n
+            if current_time - self.history_ts[slot] <= WINDOW_SIZE:
+                break
+            self.window_sum -= self.history_rssi[slot] * self.history_count[slot]
+            self.window_count -= 1
+            self.window_readings -= self.history_count[slot]
+            expired = True
+        if expired and self.pair_slot >= 0:
+            pair_store.changed.add(self)
+        return expired
+
+    # Recompute the running window stats from the newest `window_count` entries
+    def recompute_window_sum(self):
+        n = len(self.history_rssi)
+        first = (self.history_start + n - self.window_count) % n if n else 0
+        end = first + self.window_count
+        if end <= n:
+            slots = [(first, end)]
+        else:
+            slots = [(first, n), (0, end - n)]
+
+        self.window_sum = 0
+        self.window_readings = 0
+        for start, stop in slots:
+            counts = self.history_count[start:stop]
+            readings = sum(counts)
+            self.window_readings += readings
+            if readings == stop - start:
+                self.window_sum += sum(self.history_rssi[start:stop])  # Raw readings only: plain sum
+            else:
+                self.window_sum += sum(map(operator.mul, self.history_rssi[start:stop], counts))
+        if self.pair_slot >= 0:
+            pair_store.changed.add(self)
+
+    # Keep the newest `size` entries, unrolled so the oldest is at index 0 (config reload)
+    def resize_history(self, size):
+        start = self.history_start
+        self.history_rssi = (self.history_rssi[start:] + self.history_rssi[:start])[-size:]
+        self.history_ts = (self.history_ts[start:] + self.history_ts[:start])[-size:]
+        self.history_count = (self.history_count[start:] + self.history_count[:start])[-size:]
+        self.history_start = 0
+        self.window_count = min(self.window_count, len(self.history_rssi))
+
+    # Recount the window as the newest entries within WINDOW_SIZE (config reload)
+    def rebuild_window(self, current_time):
+        n = len(self.history_rssi)
+        count = 0
+        while count < n:
+            slot = (self.history_start + n - 1 - count) % n
+            if current_time - self.history_ts[slot] > WINDOW_SIZE:
+                break
+            count += 1
+        self.window_count = count
+        self.recompute_window_sum()
+
+    # Time at which the oldest reading in the window ages out
+    def window_deadline(self):
+        return self.history_ts[self._slot(len(self.history_rssi) - self.window_count)] + WINDOW_SIZE + 1
+
+pair_slot_of = operator.attrgetter("pair_slot")
+window_sum_of = operator.attrgetter("window_sum")
+window_readings_of = operator.attrgetter("window_readings")
+
+# Window stats of every (gateway, tag) pair in persistent NumPy arrays, one slot per pair, for
+# score_tags_numpy. Tags flag themselves when update_data or window expiry changes their stats;
+# the flagged slots are copied in one vectorized assignment per tick
+class PairStore:
+    __slots__ = ("sums", "readings", "gateway_ids", "tag_slots", "size", "free", "changed")
+
+    def __init__(self, capacity=1024):
+        self.sums = np.zeros(capacity, dtype=np.float64)  # window_sum per slot
+        self.readings = np.zeros(capacity, dtype=np.int64)  # window_readings per slot
+        self.gateway_ids = np.empty(capacity, dtype=object)
+        self.tag_slots = {}  # {tag_id: [slot, ...]} in tag_index order
+        self.size = 0  # Slots handed out so far
+        self.free = []  # Slots released by removed pairs, reused first
+        self.changed = set()  # Tags whose slot is stale
+
+    def add(self, gateway_id, tag):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = self.size
+            self.size += 1
+            if slot == len(self.sums):
+                # Full: double the capacity
+                self.sums = np.concatenate((self.sums, np.zeros_like(self.sums)))
+                self.readings = np.concatenate((self.readings, np.zeros_like(self.readings)))
+                self.gateway_ids = np.concatenate((self.gateway_ids, np.empty(slot, dtype=object)))
+        self.gateway_ids[slot] = gateway_id
+        self.tag_slots.setdefault(tag.tag_id, []).append(slot)
+        tag.pair_slot = slot
+        self.changed.add(tag)
+
+    def remove(self, tag):
+        slot = tag.pair_slot
+        slots = self.tag_slots[tag.tag_id]
+        slots.remove(slot)
+        if not slots:
+            del self.tag_slots[tag.tag_id]
+        self.changed.discard(tag)
+        self.gateway_ids[slot] = None
+        self.free.append(slot)
+        tag.pair_slot = -1
+
+    # Copy the stats of the flagged tags into their slots
+    def sync(self):
+        if not self.changed:
+            return
+        tags = list(self.changed)
+        self.changed.clear()
+        slots = list(map(pair_slot_of, tags))
+        self.sums[slots] = list(map(window_sum_of, tags))
+        self.readings[slots] = list(map(window_readings_of, tags))
+
+# Only the vectorized engine keeps the arrays
+def new_pair_store():
+    return PairStore() if SCORING_ENGINE == "numpy" and np is not None else None
+
+pair_store = new_pair_store()
+
+#-------------------------------------------------------
+# Snapshot and warm restart
+# `processor_snapshot` holds one binary blob per (partition, gateway):
+#   header: b"BGS2", gateway_id (u16 length + utf-8), tag count (u32)
+#   per tag: tag_id (u8 length + utf-8), rssi (i16), timestamp (u32), flag_timeout (u8),
+#            history start, length and window count (3 x u16), RSSI history (i8 each), timestamps (u32 each),
+#            readings per entry (u16 each; absent from b"BGS1" blobs, where every entry is one reading)
+#-------------------------------------------------------
+SNAPSHOT_MAGIC = b"BGS2"
+SNAPSHOT_MAGIC_V1 = b"BGS1"
+SNAPSHOT_HEADER = struct.Struct("<4sH")
+SNAPSHOT_TAG = struct.Struct("<hIBHHH")
+
+def encode_gateway_snapshot(gateway_id, tags):
+    gateway_bytes = gateway_id.encode()
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(gateway_bytes)), gateway_bytes, struct.pack("<I", len(tags))]
+
+    for tag in tags:
+        tag_bytes = tag.tag_id.encode()
+        history_ts = tag.history_ts
+        history_count = tag.history_count
+        if sys.byteorder == "big":
+            history_ts = array("I", history_ts)
+            history_ts.byteswap()
+            history_count = array("H", history_count)
+            history_count.byteswap()
+
+        parts.append(struct.pack("<B", len(tag_bytes)))
+        parts.append(tag_bytes)
+        parts.append(SNAPSHOT_TAG.pack(tag.rssi, tag.timestamp, tag.flag_timeout,
+                                       tag.history_start, len(tag.history_rssi), tag.window_count))
+        parts.append(tag.history_rssi.tobytes())
+        parts.append(history_ts.tobytes())
+        parts.append(history_count.tobytes())
+    return b"".join(parts)
+
+def decode_gateway_snapshot(blob):
+    magic, gateway_len = SNAPSHOT_HEADER.unpack_from(blob, 0)
+    if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1):
+        raise ValueError("Unknown snapshot format")
+    offset = SNAPSHOT_HEADER.size
+    gateway_id = blob[offset:offset + gateway_len].decode()
+    offset += gateway_len
+    (num_tags,) = struct.unpack_from("<I", blob, offset)
+    offset += 4
+
+    tags = []
+    for _ in range(num_tags):
+        tag_len = blob[offset]
+        tag_id = blob[offset + 1:offset + 1 + tag_len].decode()
+        offset += 1 + tag_len
+        rssi, timestamp, flag_timeout, start, n, window_count = SNAPSHOT_TAG.unpack_from(blob, offset)
+        offset += SNAPSHOT_TAG.size
+
+        tag = Tag(tag_id, rssi, timestamp, flag_timeout)
+        tag.history_rssi.frombytes(blob[offset:offset + n])
+        offset += n
+        tag.history_ts.frombytes(blob[offset:offset + 4 * n])
+        offset += 4 * n
+        if magic == SNAPSHOT_MAGIC:
+            tag.history_count.frombytes(blob[offset:offset + 2 * n])
+            offset += 2 * n
+        else:
+            tag.history_count.extend([1] * n)
+        if sys.byteorder == "big":
+            tag.history_ts.byteswap()
+            if magic == SNAPSHOT_MAGIC:
+                tag.history_count.byteswap()
+        tag.history_start = start
+
+        tag.window_count = window_count
+        tag.recompute_window_sum()
+        tags.append(tag)
+    return gateway_id, tags
+
+# Install restored tags into the in-memory state as if they had just been received
+def restore_gateway(gateway_id, tags, current_time):
+    if gateway_id not in gateways:
+        gateways[gateway_id] = Gateway(gateway_id)
+    gateway = gateways[gateway_id]
+
+    for tag in tags:
+        gateway.tags[tag.tag_id] = tag
+        tag_index.setdefault(tag.tag_id, {})[gateway_id] = tag
+        if pair_store is not None:
+            pair_store.add(gateway_id, tag)
+        heapq.heappush(expiry_heap, (tag.timestamp + TAG_TIMEOUT, next(window_seq), gateway_id, tag))
+
+        # Snapshot taken under another MAX_BUFFER_PER_BEACON: unroll the ring to the current size
+        if len(tag.history_rssi) != HISTORY_SIZE:
+            tag.resize_history(HISTORY_SIZE)
+            tag.rebuild_window(current_time)
+
+        tag.expire_window(current_time)
+        if tag.window_count:
+            schedule_window_expiry(gateway_id, tag)
+        rescore_tags.add(tag.tag_id)  # Scored on the first tick
+
+# Write the (partition, gateway) blobs that changed since the last snapshot
+async def write_snapshot():
+    dirty = set(snapshot_dirty)
+    snapshot_dirty.clear()
+
+    # Group the tags of each dirty gateway by partition once
+    by_gateway = {}
+    for partition, gateway_id in dirty:
+        by_gateway.setdefault(gateway_id, set()).add(partition)
+
+    blobs = {}
+    stale = []
+    for gateway_id, dirty_partitions in by_gateway.items():
+        gateway = gateways.get(gateway_id)
+        tags_by_partition = {}
+        for tag in (gateway.tags.values() if gateway else ()):
+            tags_by_partition.setdefault(partitions.partition_of(tag.tag_id), []).append(tag)
+
+        for partition in dirty_partitions:
+            field = f"{partition}:{gateway_id}"
+            tags = tags_by_partition.get(partition)
+            if not tags:
+                stale.append(field)
+                continue
+            try:
+                blobs[field] = encode_gateway_snapshot(gateway_id, tags)
+            except (struct.error, TypeError) as e:
+                print(f"Skipping snapshot of {field}: {e}")
+
+    pipe = async_redis_client.pipeline(transaction=False)
+    if blobs:
+        pipe.hset("processor_snapshot", mapping=blobs)
+    if stale:
+        pipe.hdel("processor_snapshot", *stale)
+
+    try:
+        await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error writing snapshot: {e}")
+        snapshot_dirty.update(dirty)  # Retry on the next snapshot
+
+async def snapshot_timer():
+    if SNAPSHOT_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        if snapshot_dirty:
+            await write_snapshot()
+
+# Warm start: restore the snapshot blobs of the partitions this process owns
+async def load_snapshot():
+    started = time.time()
+    current_time = int(started)
+    owned = {str(partition) for partition in owned_partitions}
+    restored = 0
+
+    for field, blob in (await async_redis_client.hgetall("processor_snapshot")).items():
+        partition = field.decode().split(":", 1)[0]
+        if partition not in owned:
+            continue
+        try:
+            gateway_id, tags = decode_gateway_snapshot(blob)
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            print(f"Skipping unreadable snapshot {field.decode()}: {e}")
+            continue
+        restore_gateway(gateway_id, tags, current_time)
+        restored += len(tags)
+
+    snapshot_dirty.clear()
+    print(f"Restored {restored} (gateway, tag) pair(s) from snapshot in {time.time() - started:.2f}s")
+
+#-------------------------------------------------------
+# Window expiry scheduling
+#-------------------------------------------------------
+def schedule_window_expiry(gateway_id, tag):
+    heapq.heappush(window_heap, (tag.window_deadline(), next(window_seq), gateway_id, tag))
+    tag.window_scheduled = True
+
+# Age out the windows that reached their deadline, return the (gateway_id, tag_id) pairs that changed
+def expire_windows(current_time):
+    expired = []
+    while window_heap and window_heap[0][0] <= current_time:
+        _, _, gateway_id, tag = heapq.heappop(window_heap)
+        tag.window_scheduled = False
+
+        # Skip tags that were removed from their gateway in the meantime
+        gateway = gateways.get(gateway_id)
+        if gateway is None or gateway.tags.get(tag.tag_id) is not tag:
+            continue
+
+        if tag.expire_window(current_time):
+            expired.append((gateway_id, tag.tag_id))
+        if tag.window_count:
+            schedule_window_expiry(gateway_id, tag)
+    return expired
+
+#-------------------------------------------------------
+# Hot reload of the scoring configuration
+# The UI writes `config:<KEY>` and publishes on changes.CONFIG_CHANNEL; each worker reads the
+# keys back and applies them between two ticks, keeping the in-memory history
+#-------------------------------------------------------
+CONFIG_KEYS = {
+    "WINDOW_SIZE": int,
+    "RSSI_THRESHOLD": float,
+    "FREQ_THRESHOLD": int,
+    "MAX_FREQ": int,
+    "W1": float,
+    "W2": float,
+    "MAX_BUFFER_PER_BEACON": int  # Applied as HISTORY_SIZE
+}
+
+pending_config = None  # Latest values read after a change notification, applied by process_queue
+
+async def read_config():
+    values = await async_redis_client.mget([f"config:{key}" for key in CONFIG_KEYS])
+    return {key: value.decode() for key, value in zip(CONFIG_KEYS, values) if value}
+
+# Apply changed settings, then rebuild the state derived from them and rescore every tag
+def apply_config(values, current_time):
+    changed = {}
+    for key, parse in CONFIG_KEYS.items():
+        if key not in values:
+            continue
+        try:
+            value = parse(values[key])
+        except ValueError:
+            print(f"Ignoring invalid config {key}={values[key]!r}")
+            continue
+
+        name = "HISTORY_SIZE" if key == "MAX_BUFFER_PER_BEACON" else key
+        if name == "HISTORY_SIZE":
+            value = min(max(value, 1), 0xFFFF)  # Snapshot lengths are u16
+        elif name in ("MAX_FREQ", "WINDOW_SIZE", "FREQ_THRESHOLD"):
+            value = max(value, 1)  # Scores divide by these (FREQ_THRESHOLD guards empty windows)
+        if globals()[name] != value:
+            changed[name] = value
+
+    if not changed:
+        return
+    print(f"Applying config: {changed}")
+    globals().update(changed)
+
+    if "HISTORY_SIZE" in changed:
+        for gateway_id, gateway in gateways.items():
+            for tag in gateway.tags.values():
+                tag.resize_history(HISTORY_SIZE)
+                snapshot_dirty.add((partitions.partition_of(tag.tag_id), gateway_id))
+
+    # Window membership depends on both settings: recount every window and reschedule its expiry
+    if "WINDOW_SIZE" in changed or "HISTORY_SIZE" in changed:
+        window_heap.clear()
+        for gateway_id, gateway in gateways.items():
+            for tag in gateway.tags.values():
+                tag.rebuild_window(current_time)
+                tag.window_scheduled = bool(tag.window_count)
+                if tag.window_count:
+                    window_heap.append((tag.window_deadline(), next(window_seq), gateway_id, tag))
+        heapq.heapify(window_heap)
+
+    rescore_tags.update(tag_index)  # beacon_state follows the new scores on the next tick
+
+async def load_config():
+    try:
+        apply_config(await read_config(), int(time.time()))
+    except redis.RedisError as e:
+        print(f"Error reading config, keeping defaults: {e}")
+
+# Wait for change notifications; the values are applied between ticks by process_queue
+async def config_listener():
+    global pending_config
+    while True:
+        try:
+            pubsub = async_redis_client.pubsub()
+            await pubsub.subscribe(changes.CONFIG_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    pending_config = await read_config()
+        except redis.RedisError as e:
+            print(f"Config subscription lost: {e}")
+            await asyncio.sleep(1)
+
+#-------------------------------------------------------
+# Hand events to the publisher through the configured transport
+#-------------------------------------------------------
+def queue_events(pipe, events):
+    if QUEUE_TRANSPORT == "stream":
+        for event in events:
+            pipe.xadd("aws_stream", {"data": event}, maxlen=STREAM_MAXLEN, approximate=True)
+    else:
+        pipe.rpush("aws_queue", *events)
+
+#-------------------------------------------------------
+# Event history: `beacon_event_log` plus one `beacon_event_log:<tag_id>` stream per beacon.
+# Entry IDs are millisecond timestamps, so time ranges map to XRANGE; MINID trims by age.
+#-------------------------------------------------------
+def log_events(pipe, tag_ids, events):
+    oldest_id = int(time.time() * 1000) - EVENT_LOG_RETENTION * 1000
+    for tag_id, event in zip(tag_ids, events):
+        pipe.xadd("beacon_event_log", {"data": event}, minid=oldest_id, approximate=True)
+        pipe.xadd(f"beacon_event_log:{tag_id}", {"data": event}, minid=oldest_id, approximate=True)
+        pipe.expire(f"beacon_event_log:{tag_id}", EVENT_LOG_RETENTION)  # Drop logs of beacons gone quiet
+
 #-------------------------------------------------------
-# Store or update gateway status dynamically in Redis.
+# Per-gateway beacon sets (`gateway_beacons:<gateway_id>`), updated with every beacon_state write.
+# Current gateways are always re-added (SADD is idempotent), so a beacon deleted by the UI and
+# detected again at the same gateways is counted again
 #-------------------------------------------------------
-def update_gateway_status(gateway_id, status, ip="Unknown"):
-    redis_client.hset("gateway_status", gateway_id, json.dumps({
-        "status": status,
-        "ip": ip,
-        "last_seen": time.time()
-    }))
+def update_gateway_beacons(pipe, placements):
+    added = defaultdict(list)
+    dropped = defaultdict(list)
+    for tag_id, old_scores, new_scores in placements:
+        old_gateways = {gw for gw, _ in old_scores}
+        new_gateways = {gw for gw, _ in new_scores}
+        for gateway_id in new_gateways:
+            added[gateway_id].append(tag_id)
+        for gateway_id in old_gateways - new_gateways:
+            dropped[gateway_id].append(tag_id)
+
+    for gateway_id, tag_ids in added.items():
+        pipe.sadd(f"gateway_beacons:{gateway_id}", *tag_ids)
+    for gateway_id, tag_ids in dropped.items():
+        pipe.srem(f"gateway_beacons:{gateway_id}", *tag_ids)
 
 def calculate_score(rssi_avg, freq):
     rssi_normalized = 100 - abs(rssi_avg)   # Convert RSSI into a positive normalized value
     freq_normalized = min(freq, MAX_FREQ) / MAX_FREQ    # Normalize frequency
     return (W1 * rssi_normalized) + (W2 * freq_normalized * 100)
+
 #-------------------------------------------------------
-# Process tag data to determine the nearest gateway
+# Scoring engines: return {tag_id: [(gateway_id, score), ...] best first}
 #-------------------------------------------------------
-def process_tag(beacons_to_process):
+def score_tags_python(dirty_tags, current_time):
     scores = {}
-    current_time = int(time.time())  # Get current timestamp
-
-    # Iterate over all gateways
-    for gateway_id, gateway in gateways.items():
-        for tag_id in list(gateway.tags.keys()):
-            tag = gateway.tags[tag_id]
-            filtered_data = tag.get_filtered_data(current_time)
 
-            if len(filtered_data) < FREQ_THRESHOLD:
+    for tag_id in dirty_tags:
+        for gateway_id, tag in tag_index.get(tag_id, {}).items():
+            tag.expire_window(current_time)
+            if tag.window_readings < max(FREQ_THRESHOLD, 1):
                 continue  # Not enough data for evaluation
 
-            rssi_avg = sum(r for r, _ in filtered_data) / len(filtered_data)
+            rssi_avg = tag.window_sum / tag.window_readings
 
             if rssi_avg > RSSI_THRESHOLD:
                 scores[tag_id] = scores.get(tag_id, {})  # Create entry if not exists
-                scores[tag_id][gateway_id] = calculate_score(rssi_avg, len(filtered_data))
-                update_gateway_status(gateway_id, "Online")
+                scores[tag_id][gateway_id] = calculate_score(rssi_avg, tag.window_readings)
             else:
                 print(f"Skipping {gateway_id} - RSSI too low: {rssi_avg}")
 
-    if not scores:
+    # Rank gateways per tag, ties keep their insertion order
+    ranked = {tag_id: sorted(gateway_scores.items(), key=lambda item: item[1], reverse=True)
+              for tag_id, gateway_scores in scores.items()}
+    return ranked
+
+def score_tags_numpy(dirty_tags, current_time):
+    # Windows age out from the deadline heap (already run by process_tag for this tick)
+    rescore_tags.update(tag_id for _, tag_id in expire_windows(current_time))
+    pair_store.sync()
+
+    # Slots of the dirty tags' pairs, the pairs of one tag contiguous and in tag_index order
+    tag_ids, sizes, slots = [], [], []
+    for tag_id in dirty_tags:
+        tag_slots = pair_store.tag_slots.get(tag_id)
+        if tag_slots:
+            tag_ids.append(tag_id)
+            sizes.append(len(tag_slots))
+            slots += tag_slots
+
+    if not slots:
+        return {}
+
+    slots = np.array(slots, dtype=np.intp)
+    groups = np.repeat(np.arange(len(tag_ids)), sizes)
+    sums = pair_store.sums[slots]
+    counts = pair_store.readings[slots]
+
+    # Same operations, in the same order, as calculate_score()
+    valid = counts >= max(FREQ_THRESHOLD, 1)
+    rssi_avg = np.divide(sums, counts, out=np.zeros_like(sums), where=valid)
+    valid &= rssi_avg > RSSI_THRESHOLD
+    freq_normalized = np.minimum(counts, MAX_FREQ) / MAX_FREQ
+    scores = (W1 * (100 - np.abs(rssi_avg))) + (W2 * freq_normalized * 100)
+
+    # Sort each tag's gateways by descending score in one stable pass; the first is the argmax
+    idx = np.flatnonzero(valid)
+    if not len(idx):
+        return {}
+    order = idx[np.lexsort((-scores[idx], groups[idx]))]
+
+    # Cut the sorted pairs into one ranked list per tag
+    ordered_groups = groups[order]
+    starts = (np.flatnonzero(np.diff(ordered_groups)) + 1).tolist()
+    ranked_pairs = list(zip(pair_store.gateway_ids[slots[order]].tolist(), scores[order].tolist()))
+    return {tag_ids[group]: ranked_pairs[start:stop]
+            for group, start, stop in zip(ordered_groups[[0] + starts].tolist(), [0] + starts, starts + [len(order)])}
+
+def score_tags(dirty_tags, current_time):
+    if pair_store is not None:
+        return score_tags_numpy(dirty_tags, current_time)
+    return score_tags_python(dirty_tags, current_time)
+
+#-------------------------------------------------------
+# Process tag data to determine the nearest gateway
+#-------------------------------------------------------
+async def process_tag(beacons_to_process):
+    started = time.time()
+    current_time = int(started)  # Get current timestamp
+
+    # Listener receipt time of each tag's newest reading, carried into its events
+    ingested_at = {beacon["tag_id"]: beacon["ingest_ts"] for beacon in beacons_to_process if "ingest_ts" in beacon}
+
+    # Only rescore tags touched by this batch or whose window just aged out
+    dirty_tags = {beacon["tag_id"] for beacon in beacons_to_process}
+    dirty_tags.update(tag_id for _, tag_id in expire_windows(current_time))
+    dirty_tags.update(rescore_tags)
+    rescore_tags.clear()
+
+    ranked = score_tags(dirty_tags, current_time)
+
+    if dirty_tags and not ranked:
         print(f"DEBUG: No gateways above threshold for any tag")
-        return
+
+    # All writes of this tick go out in one pipeline
+    pipe = async_redis_client.pipeline(transaction=False)
+
+    beacon_entries = {}
+    state_updates = {}
+    events = []
+    event_updates = {}
 
     # Determine the nearest gateway per tag
-    for tag_id, gateway_scores in scores.items():
-        nearest_gw = max(gateway_scores, key=gateway_scores.get)  # Find best gateway
-        detected_gateways = sorted(gateway_scores.keys(), key=lambda g: gateway_scores[g], reverse=True)
+    for tag_id, gateway_scores in ranked.items():
+        nearest_gw, nearest_score = gateway_scores[0]  # Find best gateway
 
-        print(f"Beacon {tag_id} detected at {nearest_gw} with score {gateway_scores[nearest_gw]}")
+        # Only rewrite beacon_state when the placement or the scores changed
+        if written_state.get(tag_id) != gateway_scores:
+            print(f"Beacon {tag_id} detected at {nearest_gw} with score {nearest_score}")
 
-        beacon_entry = {
-                "gateways": detected_gateways,  # List of detected gateways
-                "rssi_scores": {gw: gateway_scores[gw] for gw in detected_gateways},  # RSSI scores
+            beacon_entries[tag_id] = codec.dumps({
+                "gateways": [gw for gw, _ in gateway_scores],  # List of detected gateways
+                "rssi_scores": dict(gateway_scores),  # RSSI scores
                 "timestamp": current_time
-            }
-
-        redis_client.hset("beacon_state", tag_id, json.dumps(beacon_entry))
+            })
+            state_updates[tag_id] = gateway_scores
 
-        last_event = redis_client.hget("beacon_last_event", tag_id)
-        if last_event is None or last_event.decode() == "lost":
-            redis_client.rpush("aws_queue", json.dumps({
+        if last_events.get(tag_id, "lost") == "lost":
+            event = {
                 "event": "detected",
                 "beacon_id": tag_id,
                 "gateway": nearest_gw,
                 "timestamp": current_time
-            }))
-            redis_client.hset("beacon_last_event", tag_id, "detected")
+            }
+            if tag_id in ingested_at:
+                event["ingest_ts"] = ingested_at[tag_id]  # Internal: end-to-end latency, stripped by the publisher
+            events.append(codec.dumps(event))
+            event_updates[tag_id] = "detected"
+
+    if beacon_entries:
+        pipe.hset("beacon_state", mapping=beacon_entries)
+        changes.record_beacon_changes(pipe, beacon_entries)
+        update_gateway_beacons(pipe, [(tag_id, written_state.get(tag_id, ()), gateway_scores)
+                                      for tag_id, gateway_scores in state_updates.items()])
+    if events:
+        queue_events(pipe, events)
+        log_events(pipe, event_updates, events)
+        pipe.hset("beacon_last_event", mapping=event_updates)
+
+    # Change notifications for the UI, sent with the writes they describe
+    if beacon_entries or events:
+        changes.publish_change(pipe, "beacons", changed=len(beacon_entries), detected=len(events))
+    if beacons_to_process or events:
+        changes.publish_change(pipe, "queues")
+
+    try:
+        await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error writing tick results: {e}")
+        rescore_tags.update(ranked)  # Retry these tags on the next tick
+        stage_metrics.count("write_errors")
+        return
+
+    written_state.update(state_updates)
+    last_events.update(event_updates)
 
-# Soft timer to check flag_timeout and remove expired tags every second
+    finished = time.time()
+    stage_metrics.count("ticks")
+    stage_metrics.count("scored", len(ranked))
+    stage_metrics.count("events", len(events))
+    stage_metrics.observe("tick_ms", (finished - started) * 1000)
+    stage_metrics.observe("tick_beacons", len(beacons_to_process))
+    for ingest_ts in ingested_at.values():
+        stage_metrics.observe("ingest_to_scored_ms", (finished - ingest_ts) * 1000)
+
+# Pop the tags whose last reading is older than TAG_TIMEOUT, return them as (gateway_id, tag_id)
+def pop_expired_tags(current_time):
+    expired_tags = []
+    while expiry_heap and expiry_heap[0][0] <= current_time:
+        _, _, gateway_id, tag = heapq.heappop(expiry_heap)
+
+        # Skip tags that were already removed from their gateway
+        gateway = gateways.get(gateway_id)
+        if gateway is None or gateway.tags.get(tag.tag_id) is not tag:
+            continue
+
+        # Seen again since this entry was scheduled: move its deadline
+        deadline = tag.timestamp + TAG_TIMEOUT
+        if deadline > current_time:
+            heapq.heappush(expiry_heap, (deadline, next(window_seq), gateway_id, tag))
+            continue
+
+        expired_tags.append((gateway_id, tag.tag_id))
+    return expired_tags
+
+# Soft timer: expire each tag close to its own deadline, cost is proportional to the expirations
 async def soft_timer():
     while True:
-        await asyncio.sleep(30)  # Run every 30 seconds
+        # Sleep until the next deadline, but wake at least every second
+        delay = 1.0
+        if expiry_heap:
+            delay = min(max(expiry_heap[0][0] - time.time(), 0.05), 1.0)
+        await asyncio.sleep(delay)
         current_time = int(time.time())
 
-        expired_tags = []
-        for gateway_id, gateway in gateways.items():
-            for tag_id, tag in list(gateway.tags.items()):
-                # Handle `flag_timeout`
-                if tag.flag_timeout == 1:
-                    tag.flag_timeout = 0  # Reset it to 0 (next cycle will check again)
-                elif tag.flag_timeout == 0:
-                    expired_tags.append((gateway_id, tag_id))  # Remove this tag
+        expired_tags = pop_expired_tags(current_time)
+        if not expired_tags and not pending_removals:
+            continue
 
         # Remove expired tags
         for gateway_id, tag_id in expired_tags:
             print(f"Removing expired Tag: {tag_id} from Gateway {gateway_id}")
 
-            last_event = redis_client.hget("beacon_last_event", tag_id)
+            # Other gateways still hear this tag: only its placement changes
+            if not gateways[gateway_id].remove_tag(tag_id):
+                rescore_tags.add(tag_id)
+                continue
+            pending_removals[tag_id] = (gateway_id, current_time)
 
-            # Only log "lost" if the last event was "detected"
-            if last_event is None or last_event.decode() == "detected":
-                redis_client.rpush("aws_queue", json.dumps({
+        # Tags heard again since a failed write are back in process_tag's hands, not lost
+        removed = {tag_id: removal for tag_id, removal in pending_removals.items() if tag_id not in tag_index}
+        pending_removals.clear()
+        if not removed:
+            continue
+
+        # Only log "lost" if the last event was "detected"
+        events = []
+        event_updates = {}
+        for tag_id, (gateway_id, removed_at) in removed.items():
+            if last_events.get(tag_id, "detected") == "detected":
+                events.append(codec.dumps({
                     "event": "lost",
                     "beacon_id": tag_id,
                     "gateway": gateway_id,
-                    "timestamp": current_time
+                    "timestamp": removed_at
                 }))
-                redis_client.hset("beacon_last_event", tag_id, "lost")  # Store last event
+                event_updates[tag_id] = "lost"
+
+        # Remove from Redis storage and queue the lost events in one pipeline
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.hdel("beacon_state", *removed)
+        changes.record_beacon_changes(pipe, removed)
+        update_gateway_beacons(pipe, [(tag_id, written_state.get(tag_id, ()), ()) for tag_id in removed])
+        if events:
+            queue_events(pipe, events)
+            log_events(pipe, event_updates, events)
+            pipe.hset("beacon_last_event", mapping=event_updates)
+            changes.publish_change(pipe, "queues")
+        changes.publish_change(pipe, "beacons", removed=len(removed), lost=len(events))
+
+        try:
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error writing expired tags, retrying on the next wake-up: {e}")
+            pending_removals.update(removed)
+            continue
 
-            # Remove from Redis storage
-            redis_client.hdel("beacon_state", tag_id)
-            del gateways[gateway_id].tags[tag_id]
+        last_events.update(event_updates)
+        for tag_id in removed:
+            written_state.pop(tag_id, None)
 
 async def process_queue():
+    global pending_config
     while True:
         await asyncio.sleep(1)  # Process every second
 
+        # Config changes land between two ticks, never in the middle of one
+        if pending_config is not None:
+            apply_config(pending_config, int(time.time()))
+            pending_config = None
+
         beacons_to_process = []
         while not queue.empty():
             beacons_to_process.append(await queue.get())
 
         if beacons_to_process:
             print(f"Processing {len(beacons_to_process)} beacons...")  # Debugging
-            process_tag(beacons_to_process)  # Send batch to `process_tag()`
 
-async def main():
-    while True:
-        beacon_json = redis_client.lpop("beacon_data")  # Get the beacon data from queue
-        
-        if beacon_json is None:
-            await asyncio.sleep(0.5)   # Wait before checking again
-            continue 
-        try: 
-            beacon_data = json.loads(beacon_json)
-            
-            gateway_id = beacon_data["gateway_id"]
-            tag_id = beacon_data["tag_id"]
-            rssi = beacon_data["rssi"]
-            timestamp = beacon_data["timestamp"]
-            flag_timeout = beacon_data["flag_timeout"]
-
-            # Check if the gateway exists
-            if gateway_id not in gateways:
-                gateways[gateway_id] = Gateway(gateway_id) #Create a new gateway object
-
-            # Add or update the beacon in the gateway
-            gateways[gateway_id].add_beacon(tag_id, rssi, timestamp, flag_timeout)
-
-            await queue.put(beacon_data)
-
-        except json.JSONDecodeError:
-            print(f"Received non-JSON message: {beacon_json}")
+        # Run every tick so tags whose window aged out are rescored too.
+        # A failing tick is logged and its tags rescored next time, the loop must never die
+        try:
+            await process_tag(beacons_to_process)
         except Exception as e:
-            print(f"Error processing message: {e}")
+            print(f"Error processing tick: {e}")
+            rescore_tags.update(beacon["tag_id"] for beacon in beacons_to_process)
+            stage_metrics.count("tick_errors")
 
+        if stage_metrics.due(time.time()):
+            try:
+                pipe = async_redis_client.pipeline(transaction=False)
+                stage_metrics.flush(pipe)
+                await pipe.execute()
+            except redis.RedisError as e:
+                print(f"Error writing processor metrics: {e}")
 
-if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
+# Apply one raw beacon record from `beacon_data` (JSON or binary, see codec.py) to the gateway state
+def ingest_beacon(beacon_json):
+    try: 
+        beacon_data = codec.decode_beacon(beacon_json)
+        
+        gateway_id = beacon_data["gateway_id"]
+        tag_id = beacon_data["tag_id"]
+        rssi = beacon_data["rssi"]
+        timestamp = beacon_data["timestamp"]
+        flag_timeout = beacon_data["flag_timeout"]
+        count = beacon_data.get("count", 1)  # Readings aggregated by the listener into this record
+
+        # Check if the gateway exists
+        if gateway_id not in gateways:
+            gateways[gateway_id] = Gateway(gateway_id) #Create a new gateway object
+
+        # Add or update the beacon in the gateway
+        gateways[gateway_id].add_beacon(tag_id, rssi, timestamp, flag_timeout, count)
+
+        queue.put_nowait(beacon_data)
+
+        stage_metrics.count("beacons")
+        stage_metrics.count("readings", count)
+        if "ingest_ts" in beacon_data:
+            stage_metrics.observe("queue_lag_ms", (time.time() - beacon_data["ingest_ts"]) * 1000)
+
+    except json.JSONDecodeError:
+        print(f"Received non-JSON message: {beacon_json}")
+    except Exception as e:
+        print(f"Error processing message: {e}")
+
+# Load the detected/lost state machine once; afterwards it is kept in memory
+async def load_last_events():
+    stored = await async_redis_client.hgetall("beacon_last_event")
+    owned = set(owned_partitions)
+    last_events.update({tag_id.decode(): event.decode() for tag_id, event in stored.items()
+                        if partitions.PROCESSOR_PARTITIONS <= 1 or partitions.partition_of(tag_id.decode()) in owned})
+    print(f"Loaded last event of {len(last_events)} beacon(s)")
+
+# Load what beacon_state already holds, so placement diffs stay exact across restarts
+async def load_written_state():
+    stored = await async_redis_client.hgetall("beacon_state")
+    owned = set(owned_partitions)
+    for tag_id, value in stored.items():
+        tag_id = tag_id.decode()
+        if partitions.PROCESSOR_PARTITIONS > 1 and partitions.partition_of(tag_id) not in owned:
+            continue
+        try:
+            entry = json.loads(value.decode())
+            rssi_scores = entry.get("rssi_scores", {})
+            written_state[tag_id] = [(gw, rssi_scores.get(gw)) for gw in entry.get("gateways", [])]
+        except (ValueError, AttributeError):
+            continue
+
+    # Seed the per-gateway beacon sets (idempotent) in case they predate this state
+    if written_state:
+        pipe = async_redis_client.pipeline(transaction=False)
+        update_gateway_beacons(pipe, [(tag_id, (), scores) for tag_id, scores in written_state.items()])
+        await pipe.execute()
+    print(f"Loaded beacon_state of {len(written_state)} beacon(s)")
+
+async def consume_list():
+    keys = [partitions.partition_key("beacon_data", partition) for partition in owned_partitions]
+
+    while True:
+        try:
+            # Drain up to CONSUMER_BATCH_SIZE beacons per owned queue in one round-trip
+            pipe = async_redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.lpop(key, CONSUMER_BATCH_SIZE)
+            batch = [item for items in await pipe.execute() if items for item in items]
+
+            if not batch:
+                # Queues are empty: block until the next beacon arrives
+                item = await async_redis_client.blpop(keys, timeout=CONSUMER_BLOCK_TIMEOUT)
+                if item is None:
+                    continue
+                batch = [item[1]]
+        except redis.RedisError as e:
+            print(f"Error reading beacon_data: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for beacon_json in batch:
+            ingest_beacon(beacon_json)
+
+async def ensure_stream_group(stream, group):
+    try:
+        await async_redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+# Claim entries left pending by crashed consumers (or a previous run of this one)
+async def claim_stale_beacons(stream):
+    claimed = []
+    start_id = "0-0"
+    while True:
+        start_id, entries, *_ = await async_redis_client.xautoclaim(
+            stream, STREAM_GROUP, STREAM_CONSUMER, STREAM_CLAIM_IDLE_MS,
+            start_id=start_id, count=CONSUMER_BATCH_SIZE)
+        claimed.extend(entry for entry in entries if entry[1])
+        if start_id in (b"0-0", "0-0"):
+            return claimed
+
+def ingest_stream_entries(entries):
+    for _, fields in entries:
+        ingest_beacon(fields[b"data"])
+    return [entry_id for entry_id, _ in entries]
+
+async def consume_stream():
+    streams = [partitions.partition_key("beacon_stream", partition) for partition in owned_partitions]
+    for stream in streams:
+        await ensure_stream_group(stream, STREAM_GROUP)
+    last_claim = 0.0
+
+    while True:
+        try:
+            entries = {}  # {stream: [(entry_id, fields)]}
+
+            if time.time() - last_claim >= STREAM_CLAIM_IDLE_MS / 1000:
+                last_claim = time.time()
+                for stream in streams:
+                    claimed = await claim_stale_beacons(stream)
+                    if claimed:
+                        print(f"Reclaimed {len(claimed)} pending beacon(s) from {stream}")
+                        entries[stream] = claimed
+
+            if not entries:
+                response = await async_redis_client.xreadgroup(
+                    STREAM_GROUP, STREAM_CONSUMER, {stream: ">" for stream in streams},
+                    count=CONSUMER_BATCH_SIZE, block=max(1, CONSUMER_BLOCK_TIMEOUT * 1000))  # BLOCK 0 waits forever
+                entries = {stream: stream_entries for stream, stream_entries in response or []}
+
+            # Beacons are applied to the in-memory state: acknowledge them
+            for stream, stream_entries in entries.items():
+                await async_redis_client.xack(stream, STREAM_GROUP, *ingest_stream_entries(stream_entries))
+        except redis.RedisError as e:
+            print(f"Error reading beacon_stream: {e}")
+            await asyncio.sleep(1)
+
+async def main():
+    await load_config()
+    await load_last_events()
+    await load_written_state()
+    await load_snapshot()
+
+    if QUEUE_TRANSPORT == "stream":
+        await consume_stream()
+    else:
+        await consume_list()
+
+
+# Stop a worker cleanly: score what was already consumed and snapshot every tag for the next owner
+async def shutdown(loop):
+    beacons_to_process = []
+    while not queue.empty():
+        beacons_to_process.append(queue.get_nowait())
+    await process_tag(beacons_to_process)
+
+    snapshot_dirty.update((partitions.partition_of(tag_id), gateway_id)
+                          for gateway_id, gateway in gateways.items() for tag_id in gateway.tags)
+    if snapshot_dirty:
+        await write_snapshot()
+    loop.stop()
+
+# Run the processor for one shard: `worker_id` of `num_workers`
+def run_worker(worker_id, num_workers):
+    global owned_partitions, STREAM_CONSUMER
+    owned_partitions = [p for p in range(partitions.PROCESSOR_PARTITIONS) if p % num_workers == worker_id]
+    if num_workers > 1:
+        STREAM_CONSUMER = f"{STREAM_CONSUMER}-w{worker_id}"
+        print(f"Worker {worker_id} owns partitions {owned_partitions}")
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     loop.create_task(main())  # Start main() to receive beacons
     loop.create_task(process_queue())  # Start queue processor
     loop.create_task(soft_timer())  # Start soft timer
+    loop.create_task(snapshot_timer())  # Start periodic snapshots
+    loop.create_task(config_listener())  # Start config hot reload
+    loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(shutdown(loop)))
+
+    loop.run_forever()
+
+# Pool size for a MAX_WORKERS value: one process per partition at most
+def pool_size(max_workers):
+    return min(max(max_workers, 1), partitions.PROCESSOR_PARTITIONS)
+
+# MAX_WORKERS as set on the config page, None when it is unset or unreadable
+def read_max_workers(client):
+    try:
+        value = client.get("config:MAX_WORKERS")
+        return int(value) if value else None
+    except (redis.RedisError, ValueError) as e:
+        print(f"Error reading MAX_WORKERS: {e}")
+        return None
+
+# Read config:MAX_WORKERS after a change notification, None when there is nothing new
+def poll_max_workers(client, pubsub):
+    try:
+        if pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) is None:
+            return None
+    except redis.RedisError as e:
+        print(f"Error reading MAX_WORKERS: {e}")
+        time.sleep(1)
+        return None
+    return read_max_workers(client)
+
+# Keep one process per shard alive, and resize the pool when MAX_WORKERS changes.
+# Stopped workers snapshot their partitions, the new pool warm-starts from those snapshots
+def run_workers(num_workers):
+    client = redis.Redis(host="127.0.0.1", port=6379, db=0)
+    pubsub = client.pubsub()
+    try:
+        pubsub.subscribe(changes.CONFIG_CHANNEL)
+    except redis.RedisError as e:
+        print(f"Config subscription failed, MAX_WORKERS changes need a restart: {e}")
+        pubsub = None
+
+    workers = {}
+    while True:
+        for worker_id in range(num_workers):
+            worker = workers.get(worker_id)
+            if worker is None or not worker.is_alive():
+                if worker is not None:
+                    print(f"Worker {worker_id} exited with code {worker.exitcode}, restarting")
+                worker = multiprocessing.Process(target=run_worker, args=(worker_id, num_workers), daemon=True)
+                worker.start()
+                workers[worker_id] = worker
+
+        max_workers = poll_max_workers(client, pubsub) if pubsub is not None else time.sleep(1)
+        if max_workers is None or pool_size(max_workers) == num_workers:
+            continue
+
+        print(f"Resizing worker pool from {num_workers} to {pool_size(max_workers)}")
+        for worker in workers.values():
+            worker.terminate()  # SIGTERM: the worker snapshots and exits
+        for worker in workers.values():
+            worker.join(10)
+            if worker.is_alive():
+                worker.kill()
+        workers = {}
+        num_workers = pool_size(max_workers)
+
+
+if __name__ == "__main__":
+    # The config page's value survives restarts, like every other config:* key
+    max_workers = read_max_workers(redis.Redis(host="127.0.0.1", port=6379, db=0))
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+
+    num_workers = pool_size(max_workers)
+    if max_workers > partitions.PROCESSOR_PARTITIONS:
+        print(f"MAX_WORKERS={max_workers} exceeds PROCESSOR_PARTITIONS={partitions.PROCESSOR_PARTITIONS}, using {num_workers} worker(s)")
 
-    loop.run_forever()
\ No newline at end of file
+    # With several partitions the supervisor runs even for one worker, so the pool can grow later
+    if partitions.PROCESSOR_PARTITIONS > 1:
+        run_workers(num_workers)
+    else:
+        run_worker(0, 1)
@@ -1,9 +1,16 @@
-import json
+import math
 import time
 import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import redis
+from botocore.config import Config
 from dotenv import load_dotenv
+import metrics
+import codec
+import changes
 
 load_dotenv()
 
@@ -13,18 +20,275 @@ AWS_TOPIC = os.getenv("AWS_TOPIC", "beacon/status")
 QUEUE_HOST = os.getenv("QUEUE_HOST", "localhost")
 QUEUE_PORT = int(os.getenv("QUEUE_PORT", 6379))
 
+# Publishing: events are moved to `aws_processing` and only removed once AWS accepted them
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", 1))  # Events per payload (>1 publishes a JSON array)
+PUBLISH_BATCH_MS = int(os.getenv("PUBLISH_BATCH_MS", 200))  # Max age of a partial batch before it is published
+PUBLISH_WORKERS = int(os.getenv("PUBLISH_WORKERS", 4))  # Concurrent publish calls
+PUBLISH_DRAIN_SIZE = int(os.getenv("PUBLISH_DRAIN_SIZE", 100))  # Max events moved from aws_queue per round-trip
+PUBLISH_BLOCK_TIMEOUT = int(os.getenv("PUBLISH_BLOCK_TIMEOUT", 1))  # Seconds BLMOVE waits on an empty queue
+PUBLISH_RETRIES = int(os.getenv("PUBLISH_RETRIES", 3))  # Attempts before a batch is requeued
+
+# Transport from the processor: "list" (aws_queue) or "stream" (aws_stream, consumer groups)
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", 1000000))  # Approximate cap on aws_stream length
+STREAM_CLAIM_IDLE_MS = int(os.getenv("STREAM_CLAIM_IDLE_MS", 60000))  # Reclaim entries pending longer than this
+STREAM_GROUP = "publisher"
+
+# Deleted beacons: the UI records a tombstone (deletion time) instead of rewriting the queue
+DELETED_BEACON_RETENTION = int(os.getenv("DELETED_BEACON_RETENTION", 86400))  # Seconds a tombstone is kept
+STREAM_CONSUMER = os.getenv("STREAM_CONSUMER", f"{socket.gethostname()}-{os.getpid()}")
+
 redis_client = redis.Redis(host=QUEUE_HOST, port=QUEUE_PORT, db=0)
-aws_client = boto3.client('iot-data', region_name=AWS_REGION, endpoint_url=f"https://{AWS_IOT_ENDPOINT}")
+stage_metrics = metrics.StageMetrics("publisher")
+
+aws_client = boto3.client('iot-data', region_name=AWS_REGION, endpoint_url=f"https://{AWS_IOT_ENDPOINT}",
+                          config=Config(max_pool_connections=PUBLISH_WORKERS))
+
+#-------------------------------------------------------
+# aws_queue -> aws_processing -> AWS IoT
+# Events travel as (ack_token, payload): the token is the raw event for lists, the entry ID for streams
+#-------------------------------------------------------
+
+# Put events left in `aws_processing` by a previous run back at the head of `aws_queue`
+def recover_processing():
+    recovered = 0
+    while True:
+        pipe = redis_client.pipeline(transaction=False)
+        for _ in range(PUBLISH_DRAIN_SIZE):
+            pipe.lmove("aws_processing", "aws_queue", "RIGHT", "LEFT")
+        moved = sum(1 for item in pipe.execute() if item is not None)
+        recovered += moved
+        if moved < PUBLISH_DRAIN_SIZE:
+            break
+    if recovered:
+        print(f"Recovered {recovered} unacknowledged event(s) from aws_processing")
+    return recovered
+
+# Move up to PUBLISH_DRAIN_SIZE events to `aws_processing`, blocking up to `timeout` when idle
+def drain_queue(timeout):
+    pipe = redis_client.pipeline(transaction=False)
+    for _ in range(PUBLISH_DRAIN_SIZE):
+        pipe.lmove("aws_queue", "aws_processing", "LEFT", "RIGHT")
+    events = [item for item in pipe.execute() if item is not None]
+
+    if not events and timeout > 0:
+        item = redis_client.blmove("aws_queue", "aws_processing", timeout, "LEFT", "RIGHT")
+        if item is not None:
+            events.append(item)
+    return [(event, event) for event in events]
+
+def ensure_stream_group():
+    try:
+        redis_client.xgroup_create("aws_stream", STREAM_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+# Claim entries left pending by crashed publishers (or a previous run of this one)
+def claim_stale_events():
+    claimed = []
+    start_id = "0-0"
+    while True:
+        start_id, entries, *_ = redis_client.xautoclaim(
+            "aws_stream", STREAM_GROUP, STREAM_CONSUMER, STREAM_CLAIM_IDLE_MS,
+            start_id=start_id, count=PUBLISH_DRAIN_SIZE)
+        claimed += [(entry_id, fields[b"data"]) for entry_id, fields in entries if fields]
+        if start_id in (b"0-0", "0-0"):
+            return claimed
+
+def read_stream(timeout):
+    # BLOCK 0 would wait forever: round a short remaining batch age up to 1 ms
+    block = max(1, math.ceil(timeout * 1000)) if timeout > 0 else None
+    response = redis_client.xreadgroup(STREAM_GROUP, STREAM_CONSUMER, {"aws_stream": ">"},
+                                       count=PUBLISH_DRAIN_SIZE, block=block)
+    return [(entry_id, fields[b"data"]) for _, entries in response or [] for entry_id, fields in entries]
+
+def acknowledge(batch):
+    pipe = redis_client.pipeline(transaction=False)
+    if QUEUE_TRANSPORT == "stream":
+        pipe.xack("aws_stream", STREAM_GROUP, *[token for token, _ in batch])
+    else:
+        for token, _ in batch:
+            pipe.lrem("aws_processing", 1, token)
+    changes.publish_change(pipe, "queues")  # aws_queue depth changed
+    pipe.execute()
+
+# Hand a batch that could not be published back to the queue tail
+def requeue(batch):
+    pipe = redis_client.pipeline(transaction=True)
+    if QUEUE_TRANSPORT == "stream":
+        for _, event in batch:
+            pipe.xadd("aws_stream", {"data": event}, maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack("aws_stream", STREAM_GROUP, *[token for token, _ in batch])
+    else:
+        for token, _ in batch:
+            pipe.lrem("aws_processing", 1, token)
+        pipe.rpush("aws_queue", *[event for _, event in batch])
+    pipe.execute()
+
+# Split off events queued before their beacon was deleted (one ZMSCORE per batch)
+# Also returns the listener receipt times (ingest_ts) of the kept events
+def decode_event(event):
+    try:
+        return codec.loads(event)
+    except codec.JSONDecodeError:
+        return {}  # Published as queued, like before events were inspected
+
+def drop_deleted(batch):
+    events = [decode_event(event) for _, event in batch]
+    deleted_at = redis_client.zmscore("deleted_beacons", [event.get("beacon_id", "") for event in events])
+
+    kept, dropped, ingest_times = [], [], []
+    for item, event, deleted in zip(batch, events, deleted_at):
+        if deleted is not None and event.get("timestamp", 0) < deleted:  # Whole seconds: same second is kept
+            dropped.append(item)
+        else:
+            kept.append(item)
+            if event.get("ingest_ts"):
+                ingest_times.append(event["ingest_ts"])
+    return kept, dropped, ingest_times
+
+def trim_tombstones():
+    redis_client.zremrangebyscore("deleted_beacons", "-inf", time.time() - DELETED_BEACON_RETENTION)
 
-def main():
+# An event as published to AWS: the internal ingest_ts (latency metrics) is not part of the schema
+def external_event(event):
+    if b'"ingest_ts"' not in event:
+        return event.decode()
+    try:
+        data = codec.loads(event)
+    except codec.JSONDecodeError:
+        return event.decode()
+    data.pop("ingest_ts", None)
+    payload = codec.dumps(data)
+    return payload.decode() if isinstance(payload, bytes) else payload
+
+def build_payload(batch):
+    if PUBLISH_BATCH_SIZE <= 1:
+        return external_event(batch[0][1])
+    return "[" + ",".join(external_event(event) for _, event in batch) + "]"
+
+# Run a Redis step of a batch until it succeeds; meanwhile the batch stays in aws_processing
+# (or pending in the stream group), so nothing is lost or published twice
+def retry_redis(step, *args):
+    delay = 0.1
     while True:
-        if redis_client.llen("aws_queue") > 0:
-            data = redis_client.lpop("aws_queue")
-            if data:
-                data = json.loads(data.decode())
-                aws_client.publish(AWS_TOPIC, json.dumps(data), qos=1)
-                print(f"Sent to AWS: {data}")
-        time.sleep(0.1)
+        try:
+            return step(*args)
+        except redis.RedisError as e:
+            stage_metrics.count("redis_errors")
+            print(f"Error in {step.__name__}, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+# Publish one batch, then acknowledge it (or requeue it once the retries are exhausted)
+def publish_batch(batch):
+    batch, dropped, ingest_times = retry_redis(drop_deleted, batch)
+    if dropped:
+        retry_redis(acknowledge, dropped)
+        stage_metrics.count("dropped", len(dropped))
+        print(f"Dropped {len(dropped)} event(s) of deleted beacons")
+    if not batch:
+        return True
+
+    payload = build_payload(batch)
+
+    for attempt in range(1, PUBLISH_RETRIES + 1):
+        started = time.time()
+        try:
+            aws_client.publish(topic=AWS_TOPIC, qos=1, payload=payload)
+            break
+        except Exception as e:
+            stage_metrics.count("publish_errors")
+            print(f"Publish attempt {attempt} failed for {len(batch)} event(s): {e}")
+            time.sleep(0.1 * attempt)
+    else:
+        stage_metrics.count("requeued", len(batch))
+        retry_redis(requeue, batch)
+        return False
+
+    published = time.time()
+    stage_metrics.observe("publish_ms", (published - started) * 1000)
+    stage_metrics.observe("batch_size", len(batch))
+    stage_metrics.count("events", len(batch))
+    for ingest_ts in ingest_times:
+        stage_metrics.observe("end_to_end_ms", (published - ingest_ts) * 1000)
+
+    retry_redis(acknowledge, batch)
+    print(f"Sent to AWS: {len(batch)} event(s)")
+    return True
+
+# Run until `stop` (a threading.Event) is set, then finish the batches in flight
+def main(stop=None):
+    if QUEUE_TRANSPORT == "stream":
+        ensure_stream_group()
+    else:
+        recover_processing()
+
+    # Bound the batches in flight so aws_processing stays small and LREM stays cheap
+    in_flight = threading.BoundedSemaphore(PUBLISH_WORKERS * 2)
+    executor = ThreadPoolExecutor(max_workers=PUBLISH_WORKERS)
+
+    def done(future):
+        in_flight.release()
+        if future.exception() is not None:
+            stage_metrics.count("batch_errors")
+            print(f"Error publishing batch: {future.exception()!r}")
+
+    def submit(batch):
+        in_flight.acquire()
+        future = executor.submit(publish_batch, batch)
+        future.add_done_callback(done)
+
+    batch = []
+    batch_started = 0.0
+    last_claim = 0.0
+    last_trim = 0.0
+
+    while stop is None or not stop.is_set():
+        try:
+            # Wait no longer than the age left on a partial batch
+            if batch:
+                timeout = max(PUBLISH_BATCH_MS / 1000 - (time.time() - batch_started), 0)
+            else:
+                timeout = PUBLISH_BLOCK_TIMEOUT
+
+            if stage_metrics.due(time.time()):
+                pipe = redis_client.pipeline(transaction=False)
+                stage_metrics.flush(pipe)
+                pipe.execute()
+
+            if time.time() - last_trim >= 60:
+                last_trim = time.time()
+                trim_tombstones()
+
+            if QUEUE_TRANSPORT != "stream":
+                events = drain_queue(timeout)
+            elif time.time() - last_claim >= STREAM_CLAIM_IDLE_MS / 1000:
+                last_claim = time.time()
+                events = claim_stale_events() or read_stream(timeout)
+            else:
+                events = read_stream(timeout)
+        except redis.RedisError as e:
+            print(f"Error reading aws_queue: {e}")
+            time.sleep(1)
+            continue
+
+        for event in events:
+            if not batch:
+                batch_started = time.time()
+            batch.append(event)
+            if len(batch) >= PUBLISH_BATCH_SIZE:
+                submit(batch)
+                batch = []
+
+        if batch and (time.time() - batch_started) * 1000 >= PUBLISH_BATCH_MS:
+            submit(batch)
+            batch = []
+
+    if batch:
+        submit(batch)
+    executor.shutdown(wait=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
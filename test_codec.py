@@ -0,0 +1,49 @@
+import pytest
+
+import codec
+
+#-------------------------------------------------------
+# Beacon records round-trip through the binary format, or fall back to JSON
+#-------------------------------------------------------
+@pytest.fixture(autouse=True)
+def binary_records(monkeypatch):
+    monkeypatch.setattr(codec, "RECORD_CODEC", "binary")
+
+def record(tag_id="AA:BB:CC:DD:EE:FF", rssi=-60, **fields):
+    return dict({"gateway_id": "gw1", "tag_id": tag_id, "rssi": rssi, "timestamp": 1700000000,
+                 "flag_timeout": 1, "ingest_ts": 1700000000.25}, **fields)
+
+@pytest.mark.parametrize("tag_id", ["AA:BB:CC:DD:EE:FF", "aa:bb:cc:dd:ee:ff", "Aa:BB:cc:DD:ee:FF", "N/A", "tag-é", ""])
+def test_binary_round_trip(tag_id):
+    data = codec.encode_beacon(record(tag_id))
+    assert data[:1] == b"\x01"
+    assert codec.decode_beacon(data) == record(tag_id)
+
+def test_canonical_macs_pack_into_six_bytes():
+    packed = codec.encode_beacon(record("AA:BB:CC:DD:EE:FF"))
+    assert packed[1] & codec.FLAG_MAC
+    as_text = codec.encode_beacon(record("aa:bb:cc:dd:ee:ff"))
+    assert not as_text[1] & codec.FLAG_MAC  # Kept as text, case and all
+    assert len(packed) < len(as_text)
+
+def test_aggregate_round_trip():
+    aggregate = record(count=7, rssi_max=-52)
+    data = codec.encode_beacon(aggregate)
+    assert data[1] & codec.FLAG_AGGREGATE
+    assert codec.decode_beacon(data) == aggregate
+
+def test_missing_ingest_ts_stays_missing():
+    plain = record()
+    del plain["ingest_ts"]
+    assert codec.decode_beacon(codec.encode_beacon(plain)) == plain
+
+@pytest.mark.parametrize("rssi", [-60.5, "N/A", -200, None])
+def test_unpackable_records_fall_back_to_json(rssi):
+    data = codec.encode_beacon(record(rssi=rssi))
+    assert data[:1] == (b"{" if isinstance(data, bytes) else "{")
+    assert codec.decode_beacon(data) == record(rssi=rssi)
+
+def test_json_records_still_decode(monkeypatch):
+    monkeypatch.setattr(codec, "RECORD_CODEC", "json")
+    data = codec.encode_beacon(record(count=2, rssi_max=-55))
+    assert codec.decode_beacon(data) == record(count=2, rssi_max=-55)
@@ -0,0 +1,178 @@
+import json
+import random
+import struct
+from array import array
+
+import pytest
+
+import processor
+
+requires_numpy = pytest.mark.skipif(processor.np is None, reason="numpy is not installed")
+
+#-------------------------------------------------------
+# Both scoring engines must return the same placements, scores and tie order
+#-------------------------------------------------------
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # With numpy installed every test also keeps the pair store current
+    monkeypatch.setattr(processor, "SCORING_ENGINE", "numpy")
+    processor.reset_state()
+
+def ingest(gateway_id, tag_id, rssi, timestamp, count=None):
+    record = {"gateway_id": gateway_id, "tag_id": tag_id, "rssi": rssi, "timestamp": timestamp, "flag_timeout": 1}
+    if count is not None:
+        record["count"] = count
+    processor.ingest_beacon(json.dumps(record))
+
+def assert_engines_agree(current_time):
+    dirty = list(processor.tag_index)
+    assert processor.score_tags_numpy(dirty, current_time) == processor.score_tags_python(dirty, current_time)
+
+@requires_numpy
+@pytest.mark.parametrize("seed", range(5))
+def test_engines_agree_on_random_readings(seed):
+    rng = random.Random(seed)
+    now = 1000000
+    for _ in range(3000):
+        ingest(f"gw{rng.randrange(6)}", f"tag{rng.randrange(150)}", rng.randint(-100, -30),
+               now - rng.randrange(2 * processor.WINDOW_SIZE), count=rng.choice([None, 1, 3]))
+    assert_engines_agree(now)
+
+@requires_numpy
+def test_engines_agree_across_ticks():
+    rng = random.Random(7)
+    now = 1000000
+    for tick in range(30):
+        now += 1
+        for _ in range(200):
+            ingest(f"gw{rng.randrange(4)}", f"tag{rng.randrange(60)}", rng.randint(-90, -40), now,
+                   count=rng.choice([None, 2]))
+        # Drop some pairs, as soft_timer does, so their slots get reused
+        for gateway in list(processor.gateways.values()):
+            for tag_id in rng.sample(sorted(gateway.tags), min(3, len(gateway.tags))):
+                gateway.remove_tag(tag_id)
+        assert_engines_agree(now + rng.randrange(processor.WINDOW_SIZE))
+
+    store = processor.pair_store
+    stored = [tag for gateway in processor.gateways.values() for tag in gateway.tags.values()]
+    assert sorted(tag.pair_slot for tag in stored) == sorted(set(range(store.size)) - set(store.free))
+    assert store.tag_slots == {tag_id: [tag.pair_slot for tag in seen_by.values()]
+                               for tag_id, seen_by in processor.tag_index.items()}
+
+@requires_numpy
+def test_pair_store_grows():
+    now = 1000000
+    for t in range(3000):
+        ingest("gw1", f"tag{t}", -50 - t % 30, now)
+    assert len(processor.pair_store.gateway_ids) >= 3000
+    assert_engines_agree(now)
+
+@requires_numpy
+def test_ties_keep_gateway_order():
+    now = 1000000
+    for gateway_id in ("gw3", "gw1", "gw2"):
+        for second in range(3):
+            ingest(gateway_id, "tag0", -60, now - second)
+
+    dirty = ["tag0"]
+    ranked = processor.score_tags_python(dirty, now)
+    assert [gateway_id for gateway_id, _ in ranked["tag0"]] == ["gw3", "gw1", "gw2"]
+    assert processor.score_tags_numpy(dirty, now) == ranked
+
+@requires_numpy
+@pytest.mark.parametrize("freq_threshold", [-1, 0, 1, 3])
+@pytest.mark.parametrize("rssi_threshold", [-80, -60])
+def test_engines_agree_at_thresholds(monkeypatch, freq_threshold, rssi_threshold):
+    monkeypatch.setattr(processor, "FREQ_THRESHOLD", freq_threshold)
+    monkeypatch.setattr(processor, "RSSI_THRESHOLD", rssi_threshold)
+    now = 1000000
+    ingest("gw1", "at_rssi_threshold", rssi_threshold, now)
+    ingest("gw1", "aged_out", -50, now - processor.WINDOW_SIZE - 5)  # Empty window by `now`
+    for second in range(3):
+        ingest("gw2", "three_readings", -55, now - second)
+    assert_engines_agree(now)
+
+#-------------------------------------------------------
+# Tag history stores whole dBm in a signed byte
+#-------------------------------------------------------
+@pytest.mark.parametrize("rssi, stored", [(-60.5, -60), (-60.6, -61), (-60, -60), (-200, -128), (300, 127)])
+def test_update_data_coerces_rssi(rssi, stored):
+    now = 1000000
+    ingest("gw1", "tag0", rssi, now)
+    ingest("gw1", "tag0", -50, now)
+
+    tag = processor.gateways["gw1"].tags["tag0"]
+    assert tag.history == [(stored, now), (-50, now)]
+    assert tag.window_sum == stored - 50
+    assert tag.window_readings == 2
+
+#-------------------------------------------------------
+# Warm start after MAX_BUFFER_PER_BEACON changed
+#-------------------------------------------------------
+def snapshot_wrapped_tag(monkeypatch, history_size, now):
+    monkeypatch.setattr(processor, "HISTORY_SIZE", history_size)
+    for i in range(5):
+        ingest("gw1", "tag0", -50 - i, now - 4 + i)  # Wraps a ring of fewer than 5 entries
+    blob = processor.encode_gateway_snapshot("gw1", list(processor.gateways["gw1"].tags.values()))
+    processor.reset_state()
+    return blob
+
+@pytest.mark.parametrize("old_size, new_size", [(3, 5), (5, 3), (3, 4)])
+def test_restore_resizes_history(monkeypatch, old_size, new_size):
+    now = 1000000
+    blob = snapshot_wrapped_tag(monkeypatch, old_size, now)
+
+    monkeypatch.setattr(processor, "HISTORY_SIZE", new_size)
+    processor.restore_gateway(*processor.decode_gateway_snapshot(blob), now)
+    for i in range(2):
+        ingest("gw1", "tag0", -60 - i, now + 1 + i)
+
+    tag = processor.gateways["gw1"].tags["tag0"]
+    kept = [(-50 - i, now - 4 + i) for i in range(5)][-old_size:] + [(-60, now + 1), (-61, now + 2)]
+    assert tag.history == kept[-new_size:]
+    assert len(tag.history_rssi) == new_size
+
+    # The window still ages out oldest first
+    later = now + 2 + processor.WINDOW_SIZE
+    tag.expire_window(later)
+    assert (tag.window_count, tag.window_readings, tag.window_sum) == (1, 1, -61)
+
+#-------------------------------------------------------
+# Snapshot blobs round-trip every tag field, history and window
+#-------------------------------------------------------
+def tag_fields(tag):
+    return (tag.tag_id, tag.rssi, tag.timestamp, tag.flag_timeout, tag.history, list(tag.history_count),
+            tag.history_start, tag.window_count, tag.window_readings, tag.window_sum)
+
+def test_snapshot_round_trip(monkeypatch):
+    monkeypatch.setattr(processor, "HISTORY_SIZE", 4)
+    now = 1000000
+    for i in range(6):
+        ingest("gw1", "AA:BB:CC:DD:EE:01", -40 - i, now - 5 + i, count=i % 3 + 1)  # Wrapped, aggregated entries
+    ingest("gw1", "tag-é", -70, now - processor.WINDOW_SIZE - 1)  # Entry outside the window
+    ingest("gw1", "tag-é", -71, now)
+
+    tags = list(processor.gateways["gw1"].tags.values())
+    assert tags[0].history_start != 0
+    gateway_id, decoded = processor.decode_gateway_snapshot(processor.encode_gateway_snapshot("gw1", tags))
+
+    assert gateway_id == "gw1"
+    assert [tag_fields(tag) for tag in decoded] == [tag_fields(tag) for tag in tags]
+
+def test_snapshot_reads_bgs1_blobs():
+    rssi, ts = [-50, -51, -52], [1000, 1001, 1002]
+    blob = b"".join([
+        processor.SNAPSHOT_HEADER.pack(processor.SNAPSHOT_MAGIC_V1, 3), b"gw1", struct.pack("<I", 1),
+        struct.pack("<B", 4), b"tag0", processor.SNAPSHOT_TAG.pack(-51, 1002, 1, 2, 3, 2),
+        array("b", rssi).tobytes(), struct.pack("<3I", *ts)  # No per-entry reading counts
+    ])
+
+    gateway_id, (tag,) = processor.decode_gateway_snapshot(blob)
+    assert (gateway_id, tag.tag_id, tag.rssi, tag.timestamp) == ("gw1", "tag0", -51, 1002)
+    assert tag.history == [(-52, 1002), (-50, 1000), (-51, 1001)]
+    assert list(tag.history_count) == [1, 1, 1]
+    assert (tag.window_count, tag.window_readings, tag.window_sum) == (2, 2, -101)
+
+def test_snapshot_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        processor.decode_gateway_snapshot(b"BGS9" + bytes(10))
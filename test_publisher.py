@@ -0,0 +1,140 @@
+import json
+import sys
+import types
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+#-------------------------------------------------------
+# Local stand-ins for boto3/botocore, installed before publisher is imported
+#-------------------------------------------------------
+class StubIotClient:
+    def __init__(self):
+        self.payloads = []
+        self.failures = 0  # Number of upcoming publish calls that raise
+
+    def publish(self, topic, qos, payload):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("stubbed AWS IoT failure")
+        self.payloads.append(payload)
+
+stub_client = StubIotClient()
+
+boto3_stub = types.ModuleType("boto3")
+boto3_stub.client = lambda *args, **kwargs: stub_client
+botocore_stub = types.ModuleType("botocore")
+botocore_config_stub = types.ModuleType("botocore.config")
+botocore_config_stub.Config = lambda **kwargs: kwargs
+sys.modules.update({"boto3": boto3_stub, "botocore": botocore_stub, "botocore.config": botocore_config_stub})
+
+import publisher
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(publisher, "redis_client", fakeredis.FakeRedis())
+    monkeypatch.setattr(publisher.time, "sleep", lambda seconds: None)
+    stub_client.payloads.clear()
+    stub_client.failures = 0
+
+def queue_events(count):
+    events = [json.dumps({"event": "detected", "beacon_id": f"tag{i}", "gateway": "gw1", "timestamp": i})
+              for i in range(count)]
+    publisher.redis_client.rpush("aws_queue", *events)
+    return events
+
+def test_batches_are_acknowledged_after_publish(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 10)
+    events = queue_events(25)
+
+    drained = publisher.drain_queue(0)
+    assert len(drained) == 25
+    assert publisher.redis_client.llen("aws_queue") == 0
+    assert publisher.redis_client.llen("aws_processing") == 25
+
+    for start in range(0, len(drained), 10):
+        assert publisher.publish_batch(drained[start:start + 10])
+
+    published = [event for payload in stub_client.payloads for event in json.loads(payload)]
+    assert published == [json.loads(event) for event in events]
+    assert publisher.redis_client.llen("aws_processing") == 0
+
+def test_failed_batch_is_requeued(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 5)
+    queue_events(5)
+    stub_client.failures = publisher.PUBLISH_RETRIES
+
+    assert not publisher.publish_batch(publisher.drain_queue(0))
+    assert stub_client.payloads == []
+    assert publisher.redis_client.llen("aws_processing") == 0
+    assert publisher.redis_client.llen("aws_queue") == 5
+
+def test_unacknowledged_events_are_recovered_in_order():
+    events = queue_events(3)
+    publisher.drain_queue(0)
+
+    assert publisher.recover_processing() == 3
+    assert [event.decode() for event in publisher.redis_client.lrange("aws_queue", 0, -1)] == events
+
+def test_stream_transport_acknowledges_published_entries(monkeypatch):
+    monkeypatch.setattr(publisher, "QUEUE_TRANSPORT", "stream")
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 10)
+    publisher.ensure_stream_group()
+    for i in range(4):
+        publisher.redis_client.xadd("aws_stream", {"data": json.dumps({"event": "lost", "beacon_id": f"tag{i}"})})
+
+    batch = publisher.read_stream(0)
+    assert len(batch) == 4
+    assert publisher.redis_client.xpending("aws_stream", "publisher")["pending"] == 4
+
+    assert publisher.publish_batch(batch)
+    assert len(json.loads(stub_client.payloads[0])) == 4
+    assert publisher.redis_client.xpending("aws_stream", "publisher")["pending"] == 0
+
+def test_events_of_deleted_beacons_are_dropped(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 10)
+    queue_events(3)
+    publisher.redis_client.zadd("deleted_beacons", {"tag1": 2})  # tag1 was queued at second 1
+    later = json.dumps({"event": "detected", "beacon_id": "tag1", "gateway": "gw1", "timestamp": 5})
+    publisher.redis_client.rpush("aws_queue", later)
+
+    assert publisher.publish_batch(publisher.drain_queue(0))
+    assert [event["beacon_id"] for event in json.loads(stub_client.payloads[0])] == ["tag0", "tag2", "tag1"]
+    assert publisher.redis_client.llen("aws_processing") == 0
+
+def test_redis_errors_are_retried_without_losing_the_batch(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 10)
+    queue_events(3)
+    batch = publisher.drain_queue(0)
+
+    failures = {"zmscore": 1, "acknowledge": 1}
+    zmscore = publisher.redis_client.zmscore
+    acknowledge = publisher.acknowledge
+
+    def flaky_zmscore(*args):
+        if failures["zmscore"]:
+            failures["zmscore"] -= 1
+            raise publisher.redis.ConnectionError("stubbed Redis failure")
+        return zmscore(*args)
+
+    def flaky_acknowledge(batch):
+        if failures["acknowledge"]:
+            failures["acknowledge"] -= 1
+            raise publisher.redis.ConnectionError("stubbed Redis failure")
+        acknowledge(batch)
+
+    monkeypatch.setattr(publisher.redis_client, "zmscore", flaky_zmscore)
+    monkeypatch.setattr(publisher, "acknowledge", flaky_acknowledge)
+
+    assert publisher.publish_batch(batch)
+    assert len(stub_client.payloads) == 1  # Published once, acknowledged after the retry
+    assert publisher.redis_client.llen("aws_processing") == 0
+
+def test_internal_ingest_time_is_not_published(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 10)
+    event = {"event": "detected", "beacon_id": "tag0", "gateway": "gw1", "timestamp": 1}
+    publisher.redis_client.rpush("aws_queue", json.dumps(dict(event, ingest_ts=0.5)), json.dumps(event))
+
+    assert publisher.publish_batch(publisher.drain_queue(0))
+    assert json.loads(stub_client.payloads[0]) == [event, event]
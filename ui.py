@@ -1,16 +1,20 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import redis
 import json
 import os
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
-from collections import defaultdict
+from collections import deque
 import time
 import threading
-from functools import wraps
+from functools import wraps, lru_cache
 import hashlib
 from datetime import datetime
+import metrics
+import codec
+import changes
+import partitions
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "your-secret-key")
@@ -21,6 +25,13 @@ BROKER_HOST = os.getenv("BROKER_HOST", "localhost")
 BROKER_PORT = int(os.getenv("BROKER_PORT", 1883))
 QUEUE_HOST = os.getenv("QUEUE_HOST", "localhost")
 QUEUE_PORT = int(os.getenv("QUEUE_PORT", 6379))
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")  # "list" or "stream"
+DASHBOARD_INTERVAL = float(os.getenv("DASHBOARD_INTERVAL", 5))  # Seconds between dashboard refreshes without change events (rates, stage status)
+UI_PUSH_MS = int(os.getenv("UI_PUSH_MS", 50))  # Min spacing of Socket.IO pushes; change events in between are coalesced
+DASHBOARD_MIN_INTERVAL = float(os.getenv("DASHBOARD_MIN_INTERVAL", 1))  # Min seconds between change-driven dashboard refreshes
+BEACONS_PER_PAGE = 100  # Default page size of /api/beacons
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 10))  # Seconds of pipeline metrics behind rates and percentiles
+STAGE_STALE_AFTER = 10  # Seconds without a metrics flush before a stage is reported Stopped
 redis_client = redis.Redis(host=QUEUE_HOST, port=QUEUE_PORT, db=0)
 
 mqtt_client = mqtt.Client()
@@ -30,7 +41,19 @@ mqtt_client.loop_start()
 #-------------------------------------------------------------------------------------
 # PUBLIC VARIABLES
 #-------------------------------------------------------------------------------------
-gateways = []
+# Dashboard aggregates, refreshed on change events (at least once per DASHBOARD_INTERVAL) and shared by Socket.IO and /api/dashboard
+dashboard_cache = {}
+dashboard_cache_time = 0.0
+
+# (time, metrics snapshot) pairs covering the last METRICS_WINDOW seconds
+metrics_history = deque()
+
+# Newest beacon_changes version already pushed to Socket.IO clients
+pushed_beacon_version = None  # None until a beacons client joins
+
+# Pages receiving pushes, one Socket.IO room each, and the page of every connected client {sid: page}
+PAGES = ("dashboard", "beacons", "gateways")
+page_clients = {}
 #-------------------------------------------------------------------------------------
 # PUBLIC FUNCTIONS
 #-------------------------------------------------------------------------------------
@@ -38,34 +61,283 @@ def init_users():
     if not redis_client.exists("users"):
         redis_client.hset("users", "admin", hashlib.md5("admin123".encode()).hexdigest())
 
-def update_realtime_data():
-    while True:
-        msg_rate = redis_client.llen("beacon_data")
-        aws_rate = redis_client.llen("aws_queue")
-        beacons_detected = len(redis_client.hkeys("beacon_state") or [])
-        system_status = {
-            "gateways": len(gateways),
-            "gateways_online": sum(1 for gw in gateways if gw["status"] == "Online"),
+# Redis keys holding a pipeline queue, whatever the transport and partitioning
+def queue_keys(queue_name):
+    if queue_name == "beacon_data":
+        keys = partitions.partition_keys(queue_name)
+    else:
+        keys = [queue_name]
+    if QUEUE_TRANSPORT == "stream":
+        keys = [key.replace("beacon_data", "beacon_stream").replace("aws_queue", "aws_stream") for key in keys]
+    return keys
+
+# Queue the commands measuring a queue's depth; `queue_depth_from` turns their replies into a number
+def queue_depth_commands(pipe, keys):
+    for key in keys:
+        if QUEUE_TRANSPORT == "stream":
+            pipe.xinfo_groups(key)
+            pipe.xlen(key)
+        else:
+            pipe.llen(key)
+
+def queue_depth_from(replies):
+    if QUEUE_TRANSPORT != "stream":
+        return sum(replies)
+
+    depth = 0
+    for groups, length in zip(replies[0::2], replies[1::2]):
+        if isinstance(groups, Exception):
+            continue  # Stream not created yet
+        if not groups:
+            depth += length
+        else:
+            depth += max((group.get("lag") or 0) + group.get("pending", 0) for group in groups)
+    return depth
+
+# Rebuild the dashboard aggregates with a single pipelined round-trip
+def refresh_dashboard_cache():
+    global dashboard_cache, dashboard_cache_time
+    dashboard_cache_time = time.time()
+    beacon_keys = queue_keys("beacon_data")
+    aws_keys = queue_keys("aws_queue")
+
+    # Gateway counts are range reads on the listener's last-seen index
+    cutoff = dashboard_cache_time - changes.GATEWAY_OFFLINE_THRESHOLD
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hlen("beacon_state")
+    pipe.zcard("gateway_last_seen")
+    pipe.zcount("gateway_last_seen", cutoff, "+inf")
+    pipe.zrangebyscore("gateway_last_seen", "-inf", f"({cutoff}")
+    queue_depth_commands(pipe, beacon_keys)
+    queue_depth_commands(pipe, aws_keys)
+    metrics.read_commands(pipe)
+
+    try:
+        replies = pipe.execute(raise_on_error=False)
+        redis_status = "Online"
+    except redis.RedisError:
+        replies = None
+        redis_status = "Offline"
+
+    if replies is None:
+        # Keep the last known aggregates, only the Redis status changes
+        status = dict(dashboard_cache.get("status", {}), redis=redis_status)
+        dashboard_cache = dict(dashboard_cache, status=status)
+        return
+
+    beacons_detected, gateways_total, gateways_online = replies[0], replies[1], replies[2]
+    offline = [gateway_id.decode() for gateway_id in replies[3]]
+    per_queue = 2 if QUEUE_TRANSPORT == "stream" else 1
+    split = 4 + per_queue * len(beacon_keys)
+    metrics_start = split + per_queue * len(aws_keys)
+    beacon_queue_depth = queue_depth_from(replies[4:split])
+    aws_queue_depth = queue_depth_from(replies[split:metrics_start])
+
+    # Rates and latency percentiles over the last METRICS_WINDOW seconds
+    current_time = time.time()
+    snapshot = metrics.snapshot_from(replies[metrics_start:])
+    metrics_history.append((current_time, snapshot))
+    while len(metrics_history) > 2 and current_time - metrics_history[1][0] >= METRICS_WINDOW:
+        metrics_history.popleft()
+    oldest_time, oldest = metrics_history[0]
+    pipeline_metrics = metrics.summarize(oldest, snapshot, current_time - oldest_time)
+
+    def stage_status(stage):
+        return "Running" if current_time - snapshot[stage]["updated_at"] <= STAGE_STALE_AFTER else "Stopped"
+
+    dashboard_cache = {
+        "status": {
+            "gateways": gateways_total,
+            "gateways_online": gateways_online,
             "beacons_detected": beacons_detected,
             "broker": "Online" if mqtt_client.is_connected() else "Offline",
-            "redis": "Online" if redis_client.ping() else "Offline",
-            "listener": "Running",
-            "processor": "Running",
-            "publisher": "Running",
-            "alerts": ["GW3 offline for 5 minutes"] if any(gw["status"] == "Offline" for gw in gateways) else []
-        }
-        socketio.emit('update_dashboard', {
-            'status': system_status,
-            'msg_rate': msg_rate,
-            'aws_rate': aws_rate
-        })
-        time.sleep(1)
+            "redis": redis_status,
+            "listener": stage_status("listener"),
+            "processor": stage_status("processor"),
+            "publisher": stage_status("publisher"),
+            "alerts": [f"{gateway_id} offline" for gateway_id in sorted(offline)]
+        },
+        "msg_rate": pipeline_metrics["listener"]["rates"].get("messages", 0),
+        "aws_rate": pipeline_metrics["publisher"]["rates"].get("events", 0),
+        "beacon_queue_depth": beacon_queue_depth,
+        "aws_queue_depth": aws_queue_depth,
+        "metrics": pipeline_metrics
+    }
+
+# Push the beacons changed since the last push, so pages only receive deltas
+def push_beacon_changes():
+    global pushed_beacon_version
+    try:
+        if pushed_beacon_version is None:
+            pushed_beacon_version = beacons_version()
+            return
+        version, beacons, removed = read_beacon_changes(pushed_beacon_version + 1)
+    except redis.RedisError as e:
+        print(f"Error reading beacon changes: {e}")
+        return
+
+    if beacons or removed:
+        pushed_beacon_version = version
+        socketio.emit('beacon_changes', {"version": version, "beacons": beacons, "removed": removed}, to="beacons")
+
+# Dashboard aggregates for the REST endpoints, refreshed when no push kept them current
+def current_dashboard():
+    if time.time() - dashboard_cache_time >= DASHBOARD_INTERVAL:
+        refresh_dashboard_cache()
+    return dashboard_cache
+
+# Page updates needed for one change notification
+def updates_for(change):
+    change_type = change.get("type")
+    if change_type == "beacons":
+        updates = {"beacons", "gateways", "dashboard"}  # Placements also move the per-gateway counts
+        if change.get("detected") or change.get("lost"):
+            updates.add("beacon_logs")
+        return updates
+    if change_type == "gateways":
+        return {"gateways", "dashboard"}
+    if change_type == "queues":
+        return {"dashboard"}
+    return set()
+
+# Push coalesced updates to the rooms that have clients; nobody watching means no Redis reads
+def push_updates(updates):
+    global pushed_beacon_version
+    pages = set(page_clients.values())
+    if "beacons" in pages:
+        if "beacons" in updates:
+            push_beacon_changes()
+        if "beacon_logs" in updates:
+            socketio.emit('beacon_logs_changed', {}, to="beacons")
+    else:
+        pushed_beacon_version = None  # Re-read from the current version once a client joins
+    if "gateways" in updates and "gateways" in pages:
+        socketio.emit('gateway_changes', {}, to="gateways")
+    if "dashboard" in updates and "dashboard" in pages:
+        refresh_dashboard_cache()
+        socketio.emit('update_dashboard', dashboard_cache, to="dashboard")
+
+# Relay the pipeline change notifications to Socket.IO, at most one push per UI_PUSH_MS.
+# Without changes the dashboard is still refreshed every DASHBOARD_INTERVAL for rates and stage status
+def relay_changes():
+    pubsub = None
+    updates = set()
+    last_push = 0.0
+    while True:
+        try:
+            if pubsub is None:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(changes.CHANGES_CHANNEL)
+
+            if updates - {"dashboard"}:
+                timeout = max(last_push + UI_PUSH_MS / 1000 - time.time(), 0)
+            elif updates:
+                timeout = max(dashboard_cache_time + DASHBOARD_MIN_INTERVAL - time.time(),
+                              last_push + UI_PUSH_MS / 1000 - time.time(), 0)
+            elif "dashboard" in page_clients.values():
+                timeout = max(dashboard_cache_time + DASHBOARD_INTERVAL - time.time(), 0.01)
+            else:
+                timeout = DASHBOARD_INTERVAL
+
+            # Take everything already received, so a burst becomes one push
+            message = pubsub.get_message(timeout=timeout)
+            while message is not None:
+                try:
+                    updates |= updates_for(codec.loads(message["data"]))
+                except codec.JSONDecodeError:
+                    print(f"Ignoring malformed change notification: {message['data']!r}")
+                message = pubsub.get_message()
+        except redis.RedisError as e:
+            print(f"Change notifications unavailable, retrying: {e}")
+            pubsub = None
+            updates.add("dashboard")  # Show the Redis status
+            time.sleep(1)
+
+        current_time = time.time()
+        if "dashboard" not in page_clients.values():
+            updates.discard("dashboard")
+        elif current_time - dashboard_cache_time >= DASHBOARD_INTERVAL:
+            updates.add("dashboard")
+
+        # A dashboard refresh is a dozen reads: every processor tick and publisher ack asks for one,
+        # so they are held back to one per DASHBOARD_MIN_INTERVAL
+        held = set()
+        if "dashboard" in updates and current_time - dashboard_cache_time < DASHBOARD_MIN_INTERVAL:
+            held.add("dashboard")
+        if updates - held and current_time - last_push >= UI_PUSH_MS / 1000:
+            push_updates(updates - held)
+            updates = held
+            last_push = current_time
+
+#-------------------------------------------------------------------------------------
+# BEACON STATE HELPERS
+#-------------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
+def format_timestamp(timestamp):
+    # Convert timestamp to Unix time (seconds) if needed
+    if isinstance(timestamp, str):
+        try:
+            dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+            timestamp = int(time.mktime(dt.timetuple()))
+        except ValueError:
+            timestamp = None  # Handle invalid timestamps
+
+    elif isinstance(timestamp, int) and len(str(timestamp)) > 10:
+        timestamp = int(str(timestamp)[:10])  # Trim to 10 digits (seconds)
+
+    # Convert timestamp to Vietnam Time (UTC+7) manually
+    if timestamp:
+        timestamp += 7 * 3600  # Add 7 hours (7 * 3600 seconds)
+        vietnam_time = datetime.utcfromtimestamp(timestamp)
+        return vietnam_time.strftime("%Y-%m-%d %H:%M:%S")  # Store as string
+    return "N/A"
+
+def format_beacon(beacon_info):
+    detected_gateways = beacon_info.get("gateways", [])
+    return {
+        "gateways": detected_gateways,
+        "rssi_scores": beacon_info.get("rssi_scores", {}),
+        "last_seen": format_timestamp(beacon_info.get("timestamp", None)),
+        "detected": 1 if detected_gateways else 0  # Ensure the beacon is still detected
+    }
+
+def beacon_matches(beacon_info, gateway_filter, detected_filter):
+    detected_gateways = beacon_info.get("gateways", [])
+    if gateway_filter and (not detected_gateways or detected_gateways[0] != gateway_filter):
+        return False
+    if detected_filter in ("0", "1") and int(bool(detected_gateways)) != int(detected_filter):
+        return False
+    return True
+
+# Newest version recorded in `beacon_changes` (0 when empty)
+def beacons_version():
+    latest = redis_client.zrange("beacon_changes", -1, -1, withscores=True)
+    return int(latest[0][1]) if latest else 0
+
+# Beacons changed at or after version `since`: (version, {beacon_id: beacon}, [removed beacon_id])
+def read_beacon_changes(since, gateway_filter=None, detected_filter=None):
+    changed = redis_client.zrangebyscore("beacon_changes", since, "+inf", withscores=True)
+    if not changed:
+        return since, {}, []
+
+    beacon_ids = [beacon_id.decode() for beacon_id, _ in changed]
+    version = int(max(score for _, score in changed))
+
+    beacons = {}
+    removed = []
+    for beacon_id, value in zip(beacon_ids, redis_client.hmget("beacon_state", beacon_ids)):
+        beacon_info = codec.loads(value) if value else None
+        if beacon_info is None or not beacon_matches(beacon_info, gateway_filter, detected_filter):
+            removed.append(beacon_id)
+        else:
+            beacons[beacon_id] = format_beacon(beacon_info)
+    return version, beacons, removed
 
 #-------------------------------------------------------------------------------------
 # INIT SERVER
 #-------------------------------------------------------------------------------------
 init_users()
-threading.Thread(target=update_realtime_data, daemon=True).start()
+threading.Thread(target=relay_changes, daemon=True).start()
 
 #-------------------------------------------------------------------------------------
 # API FOR AUTHENTICATE SERVER
@@ -115,25 +387,7 @@ def logout():
 @app.route('/api/dashboard', methods=['GET'])
 @login_required
 def api_dashboard():
-    msg_rate = redis_client.llen("beacon_data")
-    aws_rate = redis_client.llen("aws_queue")
-    beacons_detected = len(redis_client.hkeys("beacon_state") or [])
-    system_status = {
-        "gateways": len(gateways),
-        "gateways_online": sum(1 for gw in gateways if gw["status"] == "Online"),
-        "beacons_detected": beacons_detected,
-        "broker": "Online" if mqtt_client.is_connected() else "Offline",
-        "redis": "Online" if redis_client.ping() else "Offline",
-        "listener": "Running",
-        "processor": "Running",
-        "publisher": "Running",
-        "alerts": ["GW3 offline for 5 minutes"] if any(gw["status"] == "Offline" for gw in gateways) else []
-    }
-    return jsonify({
-        "status": system_status,
-        "msg_rate": msg_rate,
-        "aws_rate": aws_rate
-    })
+    return jsonify(current_dashboard())
 
 @app.route('/')
 @login_required
@@ -145,38 +399,38 @@ def dashboard():
 #-------------------------------------------------------------------------------------
 @app.route('/api/gateways', methods=['GET'])
 def api_gateways():
-    global gateways
-    gateways = []  # Reset the global list
-
-    current_time = time.time()  # Get current time
-    offline_threshold = 30 
-
-    # Track beacons per gateway
-    gateway_beacon_counts = defaultdict(int)
-
-    for key, value in redis_client.hgetall("beacon_state").items():
-        beacon_data = json.loads(value.decode())
-
-        # Handle missing "gateways" key
-        detected_gateways = beacon_data.get("gateways", [])  # Default to an empty list if missing
-
-        for gw in detected_gateways:
-            gateway_beacon_counts[gw] += 1
-
-    # Retrieve gateway info
-    for key, value in redis_client.hgetall("gateway_status").items():
-        gateway_id = key.decode()
-        data = json.loads(value.decode())
-
-        total_beacons = gateway_beacon_counts.get(gateway_id, 0)
-
-        last_seen = data.get("last_seen", 0)
-        gateway_status = "Offline" if (current_time - last_seen) > offline_threshold else "Online"
+    id_filter = request.args.get('id', '')
+    status_filter = request.args.get('status')
+    cutoff = time.time() - changes.GATEWAY_OFFLINE_THRESHOLD
+
+    # Gateways by last MQTT message: the status filter is a score range on the index
+    if status_filter == "Online":
+        last_seen_by_gateway = redis_client.zrangebyscore("gateway_last_seen", cutoff, "+inf", withscores=True)
+    elif status_filter == "Offline":
+        last_seen_by_gateway = redis_client.zrangebyscore("gateway_last_seen", "-inf", f"({cutoff}", withscores=True)
+    else:
+        last_seen_by_gateway = redis_client.zrange("gateway_last_seen", 0, -1, withscores=True)
+    last_seen_by_gateway = [(gateway_id.decode(), last_seen) for gateway_id, last_seen in last_seen_by_gateway
+                            if id_filter in gateway_id.decode()]
+    gateway_ids = [gateway_id for gateway_id, _ in last_seen_by_gateway]
+    if not gateway_ids:
+        return jsonify([])
+
+    # Beacons per gateway are kept as sets by the processor: one SCARD each
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget("gateway_status", gateway_ids)
+    for gateway_id in gateway_ids:
+        pipe.scard(f"gateway_beacons:{gateway_id}")
+    gateway_status, *beacon_counts = pipe.execute()
+
+    gateways = []
+    for (gateway_id, last_seen), value, total_beacons in zip(last_seen_by_gateway, gateway_status, beacon_counts):
+        data = codec.loads(value) if value else {}
 
         gateways.append({
             "id": gateway_id,
             "ip": data.get("ip", "Unknown"),
-            "status": gateway_status,
+            "status": "Online" if last_seen >= cutoff else "Offline",
             "last_seen": last_seen,
             "beacons": total_beacons  # Now includes beacons from multiple gateways
         })
@@ -197,18 +451,19 @@ def gateways_list():
 # @login_required
 def delete_beacon(beacon_id):
 
-    deleted = redis_client.hdel("beacon_state", beacon_id)
-
-    new_queue = []
-    for log in redis_client.lrange("aws_queue", 0, -1):
-        log_data = json.loads(log.decode())
-        if log_data.get("beacon_id") != beacon_id:
-            new_queue.append(log)
+    current_state = redis_client.hget("beacon_state", beacon_id)
+    detected_gateways = codec.loads(current_state).get("gateways", []) if current_state else []
+
+    # Queued events are not rewritten: the tombstone makes the publisher drop the ones queued before now.
+    # Event timestamps are whole seconds, so is the tombstone: events of earlier seconds are dropped
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hdel("beacon_state", beacon_id)
+    pipe.zadd("deleted_beacons", {beacon_id: int(time.time())})
+    changes.record_beacon_changes(pipe, [beacon_id])
+    for gateway_id in detected_gateways:
+        pipe.srem(f"gateway_beacons:{gateway_id}", beacon_id)
+    deleted = pipe.execute()[0]
 
-    redis_client.delete("aws_queue")  # Clear old queue
-    for log in new_queue:
-        redis_client.rpush("aws_queue", log)  # Re-add logs without deleted beacon
-    
     if deleted:
         return jsonify({"success": True, "message": f"Deleted beacon {beacon_id}"})
     return jsonify({"success": False, "message": "Beacon not found"}), 404
@@ -220,9 +475,12 @@ def edit_beacon(beacon_id):
     # Logic chỉnh sửa (ví dụ: cập nhật gateway)
     current_state = redis_client.hget("beacon_state", beacon_id)
     if current_state:
-        state = json.loads(current_state.decode())
+        state = codec.loads(current_state)
         state["gateway"] = data.get("gateway", state["gateway"])
-        redis_client.hset("beacon_state", beacon_id, json.dumps(state))
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset("beacon_state", beacon_id, codec.dumps(state))
+        changes.record_beacon_changes(pipe, [beacon_id])
+        pipe.execute()
         return jsonify({"success": True, "message": f"Updated {beacon_id}"})
     return jsonify({"success": False, "error": "Beacon not found"}), 404
 
@@ -232,88 +490,81 @@ def edit_beacon(beacon_id):
 @app.route('/api/beacons', methods=['GET'])
 @login_required
 def api_beacons():
-
+    gateway_filter = request.args.get('gateway')
+    detected_filter = request.args.get('detected')
+    since = request.args.get('since', type=int)
+
+    # Incremental mode: only the beacons changed since the client's version
+    oldest_version = int(time.time() * 1000) - changes.BEACON_CHANGES_RETENTION * 1000
+    if since is not None and since >= oldest_version:
+        version, beacons, removed = read_beacon_changes(since, gateway_filter, detected_filter)
+        return jsonify({"version": version, "beacons": beacons, "removed": removed})
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', BEACONS_PER_PAGE, type=int), 1), 1000)
+
+    # Read the version first so changes made during the scan show up in the next delta
+    version = beacons_version()
+
+    # One HSCAN pass; only beacons that are filtered on get decoded before paging
+    filtering = bool(gateway_filter) or detected_filter in ("0", "1")
+    matched = {}
+    for beacon_id, value in redis_client.hscan_iter("beacon_state", count=1000):
+        if filtering:
+            value = codec.loads(value)
+            if not beacon_matches(value, gateway_filter, detected_filter):
+                continue
+        matched[beacon_id.decode()] = value
+
+    beacon_ids = sorted(matched)
     beacons = {}
+    for beacon_id in beacon_ids[(page - 1) * per_page:page * per_page]:
+        value = matched[beacon_id]
+        beacons[beacon_id] = format_beacon(value if filtering else codec.loads(value))
 
-    # Fetch all detected beacons from `beacon_state`
-    for beacon_id in redis_client.hkeys("beacon_state"):
-        beacon_id = beacon_id.decode()
-        beacon_data = redis_client.hget("beacon_state", beacon_id)
-        if beacon_data:
-            beacon_info = json.loads(beacon_data.decode())
-
-            detected_gateways = beacon_info.get("gateways", [])
-            rssi_scores = beacon_info.get("rssi_scores", {})
-            timestamp = beacon_info.get("timestamp", None)  # Get timestamp
-
-            # Convert timestamp to Unix time (seconds) if needed
-            if isinstance(timestamp, str):
-                try:
-                    dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-                    timestamp = int(time.mktime(dt.timetuple()))
-                except ValueError:
-                    timestamp = None  # Handle invalid timestamps
-
-            elif isinstance(timestamp, int) and len(str(timestamp)) > 10:
-                timestamp = int(str(timestamp)[:10])  # Trim to 10 digits (seconds)
-
-            # Convert timestamp to Vietnam Time (UTC+7) manually
-            if timestamp:
-                timestamp += 7 * 3600  # Add 7 hours (7 * 3600 seconds)
-                vietnam_time = datetime.utcfromtimestamp(timestamp)
-                formatted_time = vietnam_time.strftime("%Y-%m-%d %H:%M:%S")  # Store as string
-            else:
-                formatted_time = "N/A"
-
-            # Ensure the beacon is still detected
-            detected = 1 if detected_gateways else 0  
-
-            beacons[beacon_id] = {
-                "gateways": detected_gateways,  
-                "rssi_scores": rssi_scores,  
-                "last_seen": formatted_time,
-                "detected": detected
-            }
-
-    return jsonify(beacons)
+    return jsonify({
+        "version": version,
+        "total": len(beacon_ids),
+        "page": page,
+        "per_page": per_page,
+        "beacons": beacons
+    })
 
 @app.route('/api/beacon_logs', methods=['GET'])
 def api_beacon_logs():
+    # Optional filters: start/end (unix seconds), beacon_id; newest first, `cursor` continues a previous page
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    beacon_id = request.args.get('beacon_id')
+    cursor = request.args.get('cursor')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+
+    # Entry IDs of the event log are millisecond timestamps
+    key = f"beacon_event_log:{beacon_id}" if beacon_id else "beacon_event_log"
+    max_id = f"({cursor}" if cursor else (str(int(end * 1000)) if end is not None else "+")
+    min_id = str(int(start * 1000)) if start is not None else "-"
+    entries = redis_client.xrevrange(key, max=max_id, min=min_id, count=limit)
+
+    logged = [codec.loads(fields[b"data"]) for _, fields in entries]
+    deleted_at = redis_client.zmscore("deleted_beacons", [log_data.get("beacon_id", "") for log_data in logged]) if logged else []
+
     logs = []
-    for log in redis_client.lrange("aws_queue", -20, -1):
-        log_data = json.loads(log.decode())
-
-        timestamp = log_data.get("timestamp", None)
-
-        # Convert timestamp to Unix time (seconds) if needed
-        if isinstance(timestamp, str):
-            try:
-                dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-                timestamp = int(time.mktime(dt.timetuple()))
-            except ValueError:
-                timestamp = None  # Handle invalid timestamps
-
-        elif isinstance(timestamp, int) and len(str(timestamp)) > 10:
-            timestamp = int(str(timestamp)[:10])  # Trim to 10 digits (seconds)
-
-        # Convert timestamp to Vietnam Time (UTC+7) manually
-        if timestamp:
-            timestamp += 7 * 3600  # Add 7 hours (7 * 3600 seconds)
-            vietnam_time = datetime.utcfromtimestamp(timestamp)
-            log_data["timestamp"] = vietnam_time.strftime("%Y-%m-%d %H:%M:%S")  # Store as string
-        else:
-            log_data["timestamp"] = "N/A"
+    for log_data, deleted in zip(logged, deleted_at):
+        if deleted is not None and (log_data.get("timestamp") or 0) < deleted:
+            continue  # Logged before the beacon was deleted
 
-        logs.append(log_data)
+        log_data["timestamp"] = format_timestamp(log_data.get("timestamp", None))
 
-    # Sort logs by timestamp (newest first)
-    logs.sort(key=lambda x: datetime.strptime(x["timestamp"], "%Y-%m-%d %H:%M:%S") if x["timestamp"] != "N/A" else datetime.min, reverse=True)
+        logs.append(log_data)
 
-    return jsonify(logs)
+    next_cursor = entries[-1][0].decode() if len(entries) == limit else None
+    return jsonify({"logs": logs, "next_cursor": next_cursor})
 
 @app.route('/api/clear_beacon_logs', methods=['DELETE'])
 def clear_beacon_logs():
-    redis_client.delete("aws_queue")  # Delete the Redis list storing logs
+    # Clears the event history only; events still waiting for the publisher are kept
+    keys = ["beacon_event_log"] + list(redis_client.scan_iter(match="beacon_event_log:*", count=1000))
+    redis_client.delete(*keys)
     return jsonify({"success": True, "message": "All beacon logs deleted."})
 
 @app.route('/beacons')
@@ -337,9 +588,12 @@ def api_config():
                   else os.getenv(key, "") for key in config_keys}
         return jsonify(config)
     elif request.method == 'POST':
+        pipe = redis_client.pipeline()
         for key, value in request.json.items():
             if key in config_keys:
-                redis_client.set(f"config:{key}", value)
+                pipe.set(f"config:{key}", value)
+        pipe.publish(changes.CONFIG_CHANNEL, "updated")  # Processors reload without a restart
+        pipe.execute()
         return jsonify({"success": True})
 
 @app.route('/config')
@@ -360,7 +614,11 @@ def api_logs():
         logs = [log for log in logs if log["service"] == service_filter]
     if time_filter:
         logs = [log for log in logs if time_filter in log["time"]]
-    stats = {"processing_time": "50ms", "latency": "200ms"}
+    # Per-stage rates and latency percentiles from the shared dashboard aggregates
+    dashboard = current_dashboard()
+    stats = dict(dashboard.get("metrics", {}),
+                 queues={"beacon_data": dashboard.get("beacon_queue_depth"),
+                         "aws_queue": dashboard.get("aws_queue_depth")})
     return jsonify({"logs": logs, "stats": stats})
 
 @app.route('/logs')
@@ -376,6 +634,23 @@ def handle_connect():
         return False
     print("Client connected")
 
+# Each page joins its room and only receives the pushes it renders
+@socketio.on('join')
+def handle_join(page):
+    global pushed_beacon_version
+    if page not in PAGES:
+        return
+    join_room(page)
+    page_clients[request.sid] = page
+    if page == "beacons" and pushed_beacon_version is None:
+        pushed_beacon_version = beacons_version()
+    if page == "dashboard" and dashboard_cache:
+        emit('update_dashboard', dashboard_cache)  # Render right away, not on the next change
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    page_clients.pop(request.sid, None)
+
 #-------------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------------
 if __name__ == "__main__":